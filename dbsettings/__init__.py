@@ -1,2 +1,4 @@
 from dbsettings.values import *  # NOQA
 from dbsettings.group import Group  # NOQA
+
+default_app_config = 'dbsettings.apps.DbSettingsConfig'
@@ -0,0 +1,10 @@
+from django.conf.urls import url
+
+from dbsettings.views import settings_changes, settings_json
+
+
+urlpatterns = [
+    url(r'^$', settings_json, name='settings_json'),
+    url(r'^changes/$', settings_changes, name='settings_changes'),
+    url(r'^(?P<app_label>[^/]+)/$', settings_json, name='app_settings_json'),
+]
@@ -0,0 +1,32 @@
+import logging
+
+from django.apps import AppConfig
+from django.core.signals import request_started
+from django.db import DatabaseError
+
+
+logger = logging.getLogger('dbsettings')
+
+_WARM_CACHE_UID = 'dbsettings.warm_cache'
+
+
+def _warm_cache_once(**kwargs):
+    "Warms up the cache when the first request is started, see DBSETTINGS_WARM_CACHE"
+    from dbsettings.loading import warm_cache
+    request_started.disconnect(dispatch_uid=_WARM_CACHE_UID)
+    try:
+        warm_cache()
+    except DatabaseError:
+        # Most likely the table doesn't exist yet, e.g. before the first migrate
+        logger.warning('Unable to warm up the dbsettings cache.', exc_info=True)
+
+
+class DbSettingsConfig(AppConfig):
+    name = 'dbsettings'
+
+    def ready(self):
+        from dbsettings.settings import WARM_CACHE
+        if WARM_CACHE:
+            # Not done right away, so that management commands like migrate
+            # don't query the database
+            request_started.connect(_warm_cache_once, dispatch_uid=_WARM_CACHE_UID)
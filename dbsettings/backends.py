@@ -0,0 +1,213 @@
+import io
+import json
+import logging
+import os
+import threading
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import six
+
+from dbsettings import loading
+
+logger = logging.getLogger('dbsettings')
+
+__all__ = ['BaseBackend', 'DatabaseBackend', 'SnapshotBackend', 'MemoryBackend',
+           'write_snapshot']
+
+
+class BaseBackend(object):
+    "Base class for storages of setting values"
+
+    def get_storage(self, key):
+        """
+        Returns the storage of the given (module_name, class_name,
+        attribute_name) key: an object with the raw value in its ``value``
+        attribute.
+        """
+        raise NotImplementedError
+
+    def get_storages(self, keys):
+        "Returns a dict of storages of all given keys"
+        return dict((key, self.get_storage(key)) for key in keys)
+
+    def set_value(self, key, value, expected=None):
+        """
+        Stores the given raw value of a setting, returning whether it changed.
+
+        If expected is given, the value is only stored if the setting is still
+        at that version, and SettingConflict is raised otherwise.
+        """
+        raise NotImplementedError('%s does not support changing settings.' %
+                                  self.__class__.__name__)
+
+    def increment(self, key, delta):
+        "Atomically adds delta to a numeric setting and returns the new value"
+        raise NotImplementedError('%s does not support changing settings.' %
+                                  self.__class__.__name__)
+
+    def get_version(self):
+        """
+        Returns a value which changes when settings are changed by other
+        processes, or None if that can't be told, in which case lazy settings
+        read their value on every use. It's called on every use of a lazy
+        setting, so it should be cheap.
+        """
+        return None
+
+
+class DatabaseBackend(BaseBackend):
+    "Keeps settings in the database, with the Django cache in front of it"
+
+    def get_storage(self, key):
+        return loading._get_database_storage(key)
+
+    def get_storages(self, keys):
+        return loading._get_database_storages(keys)
+
+    def get_version(self):
+        return loading._get_recent_version()
+
+    def set_value(self, key, value, expected=None):
+        return loading._set_database_value(key, value, expected)
+
+    def increment(self, key, delta):
+        return loading._increment_database_value(key, delta)
+
+
+class SnapshotBackend(BaseBackend):
+    """
+    Serves settings from a snapshot file written by the ``snapshotsettings``
+    command, without any database queries or cache calls.
+
+    The file is read again when it changes, which is checked at most once
+    every ``check_interval`` seconds. Settings can't be changed.
+
+    If the file can't be read at first, ImproperlyConfigured is raised. Later
+    failures are logged, and the snapshot read before is served meanwhile.
+    """
+    check_interval = 1
+
+    def __init__(self, path=None):
+        from dbsettings.settings import SNAPSHOT_FILE
+        self.path = path or SNAPSHOT_FILE
+        if not self.path:
+            raise ImproperlyConfigured('SnapshotBackend requires DBSETTINGS_SNAPSHOT_FILE.')
+        self._values = {}
+        self._stat = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def _reload(self):
+        now = time.time()
+        if now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+                stat = st.st_ino, st.st_size, st.st_mtime
+                if stat != self._stat:
+                    with io.open(self.path, encoding='utf-8') as f:
+                        data = json.load(f)
+                    values = dict(((m, c, a), value) for m, c, a, value in data['settings'])
+            except (EnvironmentError, ValueError, TypeError, KeyError) as e:
+                if self._stat is None:
+                    raise ImproperlyConfigured('Unable to read the settings snapshot %s: %s'
+                                               % (self.path, e))
+                logger.error('Unable to read the settings snapshot %s, serving the previous one.',
+                             self.path, exc_info=True)
+            else:
+                if stat != self._stat:
+                    self._values, self._stat = values, stat
+            self._checked_at = now
+
+    def get_storage(self, key):
+        from dbsettings.models import Setting
+        self._reload()
+        try:
+            value = self._values[key]
+        except KeyError:
+            return loading._get_default_storage(*key)
+        return Setting(module_name=key[0], class_name=key[1], attribute_name=key[2],
+                       value=value)
+
+    def get_version(self):
+        self._reload()
+        return self._stat
+
+
+class MemoryBackend(BaseBackend):
+    """
+    Keeps settings in a dict of the current process, without any database
+    queries or cache calls. Meant for test suites, see also
+    dbsettings.testing.override_dbsettings.
+    """
+
+    def __init__(self):
+        # Maps keys to (raw value, version)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        "Forgets all stored values"
+        self.values.clear()
+
+    def get_storage(self, key):
+        from dbsettings.models import Setting
+        try:
+            value, version = self.values[key]
+        except KeyError:
+            return loading._get_default_storage(*key)
+        return Setting(module_name=key[0], class_name=key[1], attribute_name=key[2],
+                       value=value, version=version)
+
+    def set_value(self, key, value, expected=None):
+        with self._lock:
+            current, version = self.values.get(key, (None, 0))
+            if expected is not None and expected != version:
+                raise loading.SettingConflict('%s was changed by someone else.' % '.'.join(key))
+            if version and current == value:
+                return False
+            self.values[key] = (value, version + 1)
+        loading.send_setting_changed([key])
+        return True
+
+    def increment(self, key, delta):
+        setting = loading.get_setting(*key)
+        with self._lock:
+            value = (setting.to_python(self.get_storage(key).value) or 0) + delta
+            version = self.values.get(key, (None, 0))[1]
+            self.values[key] = (setting.get_db_prep_save(value), version + 1)
+        loading.send_setting_changed([key])
+        return value
+
+
+def write_snapshot(path):
+    """
+    Writes stored values of all settings to a snapshot file for SnapshotBackend.
+
+    The file is replaced atomically, so readers never see a partial snapshot.
+    Returns the number of settings written.
+    """
+    from dbsettings.models import Setting
+    queryset = Setting.objects.visible().using(loading.get_read_database()).order_by('pk')
+    rows = [[m, c, a, s.value]
+            for (m, c, a), s in sorted(loading._pick_storages(queryset).items())]
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with io.open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(six.text_type(json.dumps({'created': time.time(), 'settings': rows})))
+    _replace(tmp_path, path)
+    return len(rows)
+
+
+def _replace(src, dst):
+    "Renames src to dst, replacing dst also on Windows, like os.replace() of Python 3"
+    if six.PY3:
+        os.replace(src, dst)
+        return
+    try:
+        os.rename(src, dst)
+    except OSError:
+        # Python 2 on Windows doesn't rename over existing files
+        os.remove(dst)
+        os.rename(src, dst)
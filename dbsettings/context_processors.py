@@ -0,0 +1,53 @@
+from dbsettings import loading
+
+
+class SettingsNamespace(object):
+    """
+    Resolves names of settings part by part, e.g. dbsettings.myapp.Class.name
+    in templates. All settings of an app are fetched at once, when the first
+    of them is used.
+    """
+
+    def __init__(self, prefix='', values=None):
+        self._prefix = prefix
+        self._values = values
+        # Values of each app used so far, kept by the root namespace
+        self._apps = {}
+
+    def __getitem__(self, part):
+        if not self._prefix:
+            if part not in self._apps:
+                self._apps[part] = SettingsNamespace(part, _AppValues(part))
+            return self._apps[part]
+        name = '%s.%s' % (self._prefix, part)
+        values = self._values.get()
+        if name in values:
+            return values[name]
+        if name in self._values.prefixes:
+            return SettingsNamespace(name, self._values)
+        raise KeyError(part)
+
+
+class _AppValues(object):
+    "Values of all settings of an app, fetched when first needed"
+
+    def __init__(self, app_label):
+        self.app_label = app_label
+        self.values = None
+        self.prefixes = set()
+
+    def get(self):
+        if self.values is None:
+            settings = loading.get_app_settings(self.app_label)
+            storages = loading.get_setting_storages(s.key for s in settings)
+            self.values = {}
+            for setting in settings:
+                name = loading.get_setting_name(setting)
+                self.values[name] = setting.decode(storages[setting.key].value)
+                self.prefixes.add(name.rsplit('.', 1)[0])
+        return self.values
+
+
+def dbsettings(request):
+    "Makes settings available as {{ dbsettings.app.Class.attribute }}"
+    return {'dbsettings': SettingsNamespace()}
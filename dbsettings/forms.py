@@ -1,3 +1,4 @@
+import json
 import re
 
 from collections import OrderedDict
@@ -5,7 +6,7 @@ from django.apps import apps
 from django import forms
 from django.utils.text import capfirst
 
-from dbsettings.loading import get_setting_storage
+from dbsettings.loading import get_setting_storages
 
 
 RE_FIELD_NAME = re.compile(r'^(.+)__(.*)__(.+)$')
@@ -39,35 +40,55 @@ class SettingsEditor(forms.BaseForm):
 
         return field
 
+    def versions_json(self):
+        "Versions of the settings the editor was built with, to detect concurrent changes"
+        return json.dumps(self.versions)
+
+
+def can_edit(user, setting):
+    "Returns whether the user may change the given setting"
+    perm = '%s.can_edit_%s_settings' % (
+        setting.app,
+        setting.class_name.lower()
+    )
+    return user.has_perm(perm)
+
 
 def customized_editor(user, settings):
     "Customize the setting editor based on the current user and setting list"
     base_fields = OrderedDict()
     verbose_names = {}
     apps = {}
+    versions = {}
+    values = {}
+    settings = [setting for setting in settings if can_edit(user, setting)]
+    # Fetch current values of all settings at once
+    storages = get_setting_storages(setting.key for setting in settings)
     for setting in settings:
-        perm = '%s.can_edit_%s_settings' % (
-            setting.app,
-            setting.class_name.lower()
-        )
-        if user.has_perm(perm):
-            # Add the field to the customized field list
-            storage = get_setting_storage(*setting.key)
-            kwargs = {
-                'label': setting.description,
-                'help_text': setting.help_text,
-                # Provide current setting values for initializing the form
-                'initial': setting.to_editor(storage.value),
-                'required': setting.required,
-                'widget': setting.widget,
-            }
-            if setting.choices:
-                field = forms.ChoiceField(choices=setting.choices, **kwargs)
-            else:
-                field = setting.field(**kwargs)
-            key = '%s__%s__%s' % setting.key
-            apps[key] = setting.app
-            base_fields[key] = field
-            verbose_names[key] = setting.verbose_name
-    attrs = {'base_fields': base_fields, 'verbose_names': verbose_names, 'apps': apps}
+        # Add the field to the customized field list
+        storage = storages[setting.key]
+        kwargs = {
+            'label': setting.description,
+            'help_text': setting.help_text,
+            # Provide current setting values for initializing the form
+            'initial': setting.to_editor(storage.value),
+            'required': setting.required,
+            'widget': setting.widget,
+        }
+        if setting.choices:
+            field = forms.ChoiceField(choices=setting.choices, **kwargs)
+        else:
+            field = setting.field(**kwargs)
+        key = '%s__%s__%s' % setting.key
+        apps[key] = setting.app
+        base_fields[key] = field
+        verbose_names[key] = setting.verbose_name
+        values[key] = setting.decode(storage.value)
+        if getattr(storage, 'is_global', False):
+            # Saving creates the setting for the current site
+            versions[key] = 0
+        else:
+            versions[key] = getattr(storage, 'version', None)
+    attrs = {'base_fields': base_fields, 'verbose_names': verbose_names, 'apps': apps,
+             'versions': versions, 'values': values}
     return type('SettingsEditor', (SettingsEditor,), attrs)
@@ -1,8 +1,10 @@
 import sys
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
 from django.utils import six
 
 from dbsettings.values import Value
-from dbsettings.loading import register_setting, unregister_setting
+from dbsettings.loading import (register_setting, unregister_setting,
+                                increment_setting_value)
 from dbsettings.management import mk_permissions
 
 __all__ = ['Group']
@@ -19,6 +21,10 @@ class GroupBase(type):
             if not isinstance(attr, Value):
                 raise TypeError('The type of %s (%s) is not a valid Value.' %
                                 (attribute_name, attr.__class__.__name__))
+            if attribute_name in vars(Group):
+                # The setting would hide the method, or the other way around
+                raise ValueError('%s is a method of Group, and can\'t be the name of a setting.' %
+                                 attribute_name)
             mcs.add_to_class(attribute_name, attr)
         super(GroupBase, mcs).__init__(name, bases, attrs)
 
@@ -38,7 +44,7 @@ class GroupDescriptor(object):
 @six.add_metaclass(GroupBase)
 class Group(object):
 
-    def __new__(cls, verbose_name=None, copy=True, app_label=None):
+    def __new__(cls, verbose_name=None, copy=True, app_label=None, cache_timeout=DEFAULT_TIMEOUT):
         # If not otherwise provided, set the module to where it was executed
         if '__module__' in cls.__dict__:
             module_name = cls.__dict__['__module__']
@@ -57,6 +63,8 @@ class Group(object):
                 attr.verbose_name = verbose_name
             if app_label:
                 attr._app = app_label
+            if attr.cache_timeout is DEFAULT_TIMEOUT:
+                attr.cache_timeout = cache_timeout
             register_setting(attr)
 
         attr_dict = dict(attrs + [('__module__', module_name)])
@@ -113,6 +121,23 @@ class Group(object):
         for attribute_name, _ in self._settings:
             yield attribute_name, getattr(self, attribute_name)
 
+    def incr(self, attribute_name, delta=1):
+        "Atomically adds delta to a numeric setting of the group, returning the new value"
+        value = dict(self._settings)[attribute_name]
+        return increment_setting_value(*(value.key + (delta,)))
+
+    def decr(self, attribute_name, delta=1):
+        "Atomically subtracts delta from a numeric setting of the group"
+        return self.incr(attribute_name, -delta)
+
+    def matcher(self, attribute_name, ignore_case=False):
+        "Returns a ListMatcher for a MultiSeparatorValue setting of the group"
+        return dict(self._settings)[attribute_name].matcher(ignore_case)
+
+    def lazy(self, attribute_name):
+        "Returns a proxy for the value of a setting of the group, see lazy_setting"
+        return dict(self._settings)[attribute_name].lazy()
+
     def keys(self):
         return [k for (k, _) in self]
 
@@ -1,16 +1,212 @@
+import gc
+import hashlib
+import threading
+import time
 from collections import OrderedDict
 from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import F
+from django.utils import six
 
 
-__all__ = ['get_all_settings', 'get_setting', 'get_setting_storage',
-           'register_setting', 'unregister_setting', 'set_setting_value']
+__all__ = ['get_all_settings', 'get_setting', 'get_setting_storage', 'get_setting_storages',
+           'register_setting', 'unregister_setting', 'set_setting_value',
+           'set_global_setting_value', 'get_setting_name', 'get_setting_by_name',
+           'invalidate_cached_settings', 'invalidate_all_cached_settings',
+           'send_setting_changed', 'get_changed_settings',
+           'warm_cache',
+           'get_read_database', 'get_write_database', 'pin_to_primary',
+           'get_backend', 'get_settings_version', 'preload', 'SettingConflict',
+           'increment_setting_value', 'decrement_setting_value']
 
 
 _settings = OrderedDict()
 
 
-def _get_cache_key(module_name, class_name, attribute_name):
-    return '.'.join(['dbsettings', module_name, class_name, attribute_name])
+class SettingConflict(Exception):
+    "Raised when a setting was changed since the version expected by a write"
+
+# Process-local cache, used in front of the shared cache when
+# DBSETTINGS_LOCAL_CACHE_TIMEOUT is set. Maps keys to (expiry time, storage).
+_local_cache = {}
+
+# Last storage returned for each key, served while another process refills
+# the shared cache.
+_last_seen = {}
+
+# Loads in progress within this process, so concurrent misses of the same
+# key wait for a single database query. Maps keys to _Flight instances.
+_flights = {}
+_flights_lock = threading.Lock()
+
+# Decoded values loaded by preload(), before a pre-fork server starts its
+# workers. This dict is never modified afterwards, so its memory pages stay
+# shared with the workers. Keys changed since, as found by comparing
+# _preload_version with the settings version, are listed in _preload_stale and
+# read the regular way, as are all keys once another backend is in use.
+_preload = None
+_preload_backend = None
+_preload_version = None
+_preload_stale = set()
+_preload_checked_at = 0
+
+# Settings version last seen by this process, and when it was read
+_recent_version = None
+_recent_version_at = 0
+
+# How often (in seconds) the settings version is checked for changes of
+# preloaded settings, how many versions are caught up with before preloaded
+# settings are dropped instead, and for how long the list of keys changed by
+# each version is kept in cache.
+PRELOAD_CHECK_INTERVAL = 1
+PRELOAD_MAX_CHANGES = 1000
+CHANGES_TIMEOUT = 24 * 3600
+
+VERSION_KEY = 'dbsettings.version'
+
+# Generation of all cached settings, see invalidate_all_cached_settings()
+GENERATION_KEY = 'dbsettings.generation'
+
+# Present in the cache for DBSETTINGS_REPLICATION_LAG seconds after settings
+# were written by any process, see _get_fill_database()
+WRITTEN_KEY = 'dbsettings.written'
+
+# How long (in seconds) a process may hold the lock for reloading a key,
+# and how long others wait for it when they have no previous value to serve.
+LOAD_LOCK_TIMEOUT = 10
+LOAD_WAIT_TIMEOUT = 1
+
+
+# Reads go to the primary database until this time, after settings were
+# written by this process.
+_pinned_until = 0
+
+# Per-thread read-your-writes state of the current request, and the active
+# SettingsProfile with the source of the last read, while profiling.
+_request_state = threading.local()
+
+# Number of active SettingsProfiles in all threads, so reads don't pay for
+# profiling while it's not in use.
+_profiling = 0
+
+
+_backend = None
+
+# Maps names of settings (see get_setting_name) to settings, built when needed.
+_names = None
+
+
+def get_backend():
+    "Returns the storage backend instance configured by DBSETTINGS_BACKEND"
+    from django.utils.module_loading import import_string
+    from dbsettings.settings import BACKEND
+    global _backend
+    if _backend is None:
+        _backend = import_string(BACKEND)()
+    return _backend
+
+
+def _get_site_id():
+    from django.conf import settings
+    return getattr(settings, 'SITE_ID', None)
+
+
+def _hash_key(*parts):
+    """
+    Returns a cache key for the given parts, of fixed length even for long
+    names, which would otherwise exceed the key length limit of memcached.
+    """
+    digest = hashlib.md5('\0'.join(parts).encode('utf-8')).hexdigest()
+    return 'dbsettings.%s' % digest
+
+
+def _get_cache_key(module_name, class_name, attribute_name, site_id=None):
+    from dbsettings.settings import USE_SITES
+    parts = [module_name, class_name, attribute_name]
+    if USE_SITES:
+        # Values may differ between sites sharing the cache
+        parts.append(six.text_type(site_id or _get_site_id()))
+    return _hash_key(*parts)
+
+
+def _app_generation_key(app_label):
+    return _hash_key('generation', 'app', app_label)
+
+
+def _site_generation_key(site_id):
+    return _hash_key('generation', 'site', six.text_type(site_id))
+
+
+def _namespace_keys(key):
+    """
+    Returns the generation keys of the namespaces the setting belongs to: all
+    settings, its app and, with sites, the current site. Cached entries are
+    tagged with these generations, see invalidate_all_cached_settings.
+    """
+    from dbsettings.settings import USE_SITES
+    keys = [GENERATION_KEY, _app_generation_key(_settings[key].app)]
+    if USE_SITES:
+        keys.append(_site_generation_key(_get_site_id()))
+    return keys
+
+
+def _get_local(key):
+    entry = _local_cache.get(key)
+    if entry is not None and entry[0] > time.time():
+        return entry[1]
+    return None
+
+
+def _set_local(key, storage):
+    from dbsettings.settings import LOCAL_CACHE_TIMEOUT
+    if LOCAL_CACHE_TIMEOUT:
+        _local_cache[key] = (time.time() + LOCAL_CACHE_TIMEOUT, storage)
+
+
+def get_write_database():
+    from dbsettings.models import Setting
+    return router.db_for_write(Setting)
+
+
+def get_read_database():
+    """
+    Returns the database alias for loading settings.
+
+    That's DBSETTINGS_READ_DATABASE, unless settings were recently written,
+    since the replica might not have caught up with the changes yet.
+    """
+    from dbsettings.models import Setting
+    from dbsettings.settings import READ_DATABASE
+    if READ_DATABASE is None:
+        return router.db_for_read(Setting)
+    if _pinned_until > time.time() or getattr(_request_state, 'pinned', False):
+        return get_write_database()
+    return READ_DATABASE
+
+
+def pin_to_primary():
+    "Directs reads of this process and request to the primary database for a while"
+    from dbsettings.settings import READ_DATABASE, REPLICATION_LAG, USE_CACHE
+    global _pinned_until
+    _pinned_until = time.time() + REPLICATION_LAG
+    _request_state.wrote = True
+    if READ_DATABASE is not None and USE_CACHE:
+        cache.set(WRITTEN_KEY, True, REPLICATION_LAG)
+
+
+def _get_fill_database():
+    """
+    Returns the database alias for loading settings into the shared cache.
+
+    The cache is shared with processes which aren't pinned to the primary, so
+    shortly after settings were written by any process, values loaded from the
+    replica could be old ones, and are loaded from the primary instead.
+    """
+    using = get_read_database()
+    if using != get_write_database() and cache.get(WRITTEN_KEY):
+        return get_write_database()
+    return using
 
 
 def get_all_settings():
@@ -27,56 +223,947 @@ def get_setting(module_name, class_name, attribute_name):
 
 def setting_in_db(module_name, class_name, attribute_name):
     from dbsettings.models import Setting
-    return Setting.objects.filter(
+    return Setting.objects.using(get_write_database()).filter(
         module_name=module_name,
         class_name=class_name,
         attribute_name=attribute_name,
     ).count() == 1
 
 
-def get_setting_storage(module_name, class_name, attribute_name):
+def _get_default_storage(module_name, class_name, attribute_name):
     from dbsettings.models import Setting
-    from dbsettings.settings import USE_CACHE
-    storage = None
-    if USE_CACHE:
-        key = _get_cache_key(module_name, class_name, attribute_name)
-        storage = cache.get(key)
+    setting_object = get_setting(module_name, class_name, attribute_name)
+    return Setting(
+        module_name=module_name,
+        class_name=class_name,
+        attribute_name=attribute_name,
+        value=setting_object.default,
+    )
+
+
+def _pick_storages(storages):
+    """
+    Maps keys to the given storages, preferring settings of the current site
+    over global ones.
+    """
+    picked = {}
+    for storage in storages:
+        key = storage.module_name, storage.class_name, storage.attribute_name
+        if key not in picked or not storage.is_global:
+            picked[key] = storage
+    return picked
+
+
+def _load_storage(module_name, class_name, attribute_name, using=None):
+    from dbsettings.models import Setting
+    key = module_name, class_name, attribute_name
+    # At most two rows: the one of the current site, and the global one
+    queryset = Setting.objects.visible().using(using or get_read_database()).filter(
+        module_name=module_name,
+        class_name=class_name,
+        attribute_name=attribute_name,
+    )
+    storage = _pick_storages(queryset).get(key)
     if storage is None:
+        return _get_default_storage(*key)
+    return storage
+
+
+def _get_cache_timeout(key):
+    from dbsettings.settings import CACHE_TIMEOUT
+    timeout = get_setting(*key).cache_timeout
+    if timeout is DEFAULT_TIMEOUT:
+        timeout = CACHE_TIMEOUT
+    return timeout
+
+
+def _add_generations(generations):
+    """
+    Fills in values of generation keys which are None in the given dict, as
+    missing from cache.
+
+    Like the settings version, generations start from the current time, so a
+    cache flush doesn't bring back a generation which was already used.
+    """
+    for generation_key, generation in generations.items():
+        if generation is None:
+            generation = int(time.time() * 1000)
+            if not cache.add(generation_key, generation, None):
+                generation = cache.get(generation_key)
+            generations[generation_key] = generation
+    return generations
+
+
+def _get_generations(generation_keys):
+    "Returns a dict of current values of the given generation keys"
+    generations = dict((generation_key, None) for generation_key in generation_keys)
+    generations.update(cache.get_many(list(generations)))
+    return _add_generations(generations)
+
+
+def _make_cache_entries(storages, generations=None):
+    """
+    Groups cache entries for the given {key: storage} dict by their timeouts.
+
+    Each storage is cached as (generations, stale_at, storage), tagged with the
+    generations of its namespaces. Pass already fetched generations, read
+    before the storages were loaded, to save a cache call.
+
+    In stale-while-revalidate mode, entries don't expire at all. Instead, each
+    storage is cached along with the time it becomes stale.
+    """
+    from dbsettings.settings import STALE_WHILE_REVALIDATE
+    namespaces = dict((key, _namespace_keys(key)) for key in storages)
+    generations = dict(generations or {})
+    missing = set(k for keys in namespaces.values() for k in keys) - set(generations)
+    generations.update(cache.get_many(list(missing)) if missing else {})
+    for generation_key in missing:
+        generations.setdefault(generation_key, None)
+    _add_generations(generations)
+    entries = {}
+    for key, storage in storages.items():
+        timeout = _get_cache_timeout(key)
+        stale_at = None
+        if STALE_WHILE_REVALIDATE:
+            if timeout is DEFAULT_TIMEOUT:
+                timeout = cache.default_timeout
+            stale_at = None if timeout is None else time.time() + timeout
+            timeout = None
+        tag = tuple(generations[k] for k in namespaces[key])
+        entries.setdefault(timeout, {})[_get_cache_key(*key)] = (tag, stale_at, storage)
+    return entries
+
+
+def _cache_storages(storages, generations=None):
+    for timeout, entries in _make_cache_entries(storages, generations).items():
+        cache.set_many(entries, timeout)
+
+
+def _group_cache_key(group, site_id=None):
+    from dbsettings.settings import USE_SITES
+    parts = ['group'] + list(group)
+    if USE_SITES:
+        parts.append(six.text_type(site_id or _get_site_id()))
+    return _hash_key(*parts)
+
+
+def _generation_key(group):
+    # Shared by all sites, so changes of global settings reach them all
+    return _hash_key('generation', 'group', *group)
+
+
+def _get_group_timeout(keys):
+    "Entries of groups expire with the shortest timeout of their settings"
+    timeouts = set()
+    for key in keys:
+        timeout = _get_cache_timeout(key)
+        timeouts.add(cache.default_timeout if timeout is DEFAULT_TIMEOUT else timeout)
+    timeouts.discard(None)
+    return min(timeouts) if timeouts else None
+
+
+def _group_generation_keys(group, key):
+    return [_generation_key(group)] + _namespace_keys(key)
+
+
+def _cache_groups(storages, generations):
+    """
+    Caches the given storages in one entry per group, see _get_group_storages.
+    generations must hold the generations of all groups and their namespaces.
+    """
+    groups = {}
+    for key, storage in storages.items():
+        groups.setdefault(key[:2], {})[key] = storage
+    entries = {}
+    for group, group_storages in groups.items():
+        timeout = _get_group_timeout(group_storages)
+        generation_keys = _group_generation_keys(group, next(iter(group_storages)))
+        tag = tuple(generations[k] for k in generation_keys)
+        entries.setdefault(timeout, {})[_group_cache_key(group)] = (tag, group_storages)
+    for timeout, group_entries in entries.items():
+        cache.set_many(group_entries, timeout)
+
+
+def _load_groups(groups):
+    """
+    Returns storages of all settings of the given groups, fetched with a
+    single query.
+    """
+    from dbsettings.models import Setting
+    groups = set(groups)
+    storages = {}
+    queryset = Setting.objects.visible().using(_get_fill_database()).filter(
+        module_name__in=set(group[0] for group in groups),
+        class_name__in=set(group[1] for group in groups),
+    )
+    for key, storage in _pick_storages(queryset).items():
+        if key in _settings and key[:2] in groups:
+            storages[key] = storage
+    for key in _settings:
+        if key[:2] in groups and key not in storages:
+            storages[key] = _get_default_storage(*key)
+    return storages
+
+
+def _get_group_storages(keys):
+    """
+    Returns (storages, loaded) for the given keys, read from cache entries
+    holding all settings of a group (a model or a module) at once. loaded
+    tells whether any group had to be loaded from the database.
+
+    Each entry is tagged with the generation of its group, which is
+    incremented whenever a setting of the group changes. Entries of older
+    generations are ignored, so a process which loaded a group right before
+    it was changed can't bring back the old values.
+    """
+    groups = dict((key[:2], key) for key in keys)
+    generation_keys = dict((group, _group_generation_keys(group, key))
+                           for group, key in groups.items())
+    cache_keys = set(k for group_keys in generation_keys.values() for k in group_keys)
+    cache_keys.update(_group_cache_key(group) for group in groups)
+    entries = cache.get_many(list(cache_keys))
+    storages = {}
+    missing = []
+    for group in groups:
+        tag = tuple(entries.get(k) for k in generation_keys[group])
+        entry = entries.get(_group_cache_key(group))
+        if entry is not None and None not in tag and entry[0] == tag:
+            storages.update(entry[1])
+        else:
+            missing.append(group)
+    if missing:
+        # Generations are read before loading, so changes made meanwhile
+        # invalidate the entries cached here.
+        generations = _add_generations(dict(
+            (k, entries.get(k)) for group in missing for k in generation_keys[group]))
+        loaded = _load_groups(missing)
+        _cache_groups(loaded, generations)
+        storages.update(loaded)
+    return dict((key, storages[key]) for key in keys), bool(missing)
+
+
+def _spawn(func, *args):
+    thread = threading.Thread(target=func, args=args)
+    thread.daemon = True
+    thread.start()
+
+
+def _unpack_cached(entry, tag):
+    """
+    Returns (storage, stale) for the given entry of the shared cache, given
+    the current generations of the namespaces of its setting.
+
+    storage is None if there's no cached entry, or if it's from an older
+    generation.
+    """
+    if entry is None or None in tag or entry[0] != tag:
+        return None, False
+    _, stale_at, storage = entry
+    return storage, stale_at is not None and stale_at <= time.time()
+
+
+def _get_cached(key):
+    cache_key, generation_keys = _get_cache_key(*key), _namespace_keys(key)
+    entries = cache.get_many([cache_key] + generation_keys)
+    tag = tuple(entries.get(k) for k in generation_keys)
+    return _unpack_cached(entries.get(cache_key), tag)
+
+
+def _lock_key(key):
+    return _get_cache_key(*key) + '.loading'
+
+
+def _refresh(key, using=None):
+    """
+    Loads the key from the given database, by default the one returned by
+    _get_fill_database(), into the shared cache.
+
+    The caller must hold the loading lock of the key.
+    """
+    try:
+        # Read before loading, so invalidations made meanwhile aren't missed
+        generations = _get_generations(_namespace_keys(key))
+        storage = _load_storage(*key, using=using or _get_fill_database())
+        _cache_storages({key: storage}, generations)
+        return storage
+    finally:
+        cache.delete(_lock_key(key))
+
+
+def _revalidate(key):
+    if not cache.add(_lock_key(key), True, LOAD_LOCK_TIMEOUT):
+        # Some other thread or process is on it already
+        return
+    # Chosen here, since the new thread doesn't share the request's state
+    using = _get_fill_database()
+
+    def refresh():
         try:
-            storage = Setting.objects.get(
-                module_name=module_name,
-                class_name=class_name,
-                attribute_name=attribute_name,
-            )
-        except Setting.DoesNotExist:
-            setting_object = get_setting(module_name, class_name, attribute_name)
-            storage = Setting(
-                module_name=module_name,
-                class_name=class_name,
-                attribute_name=attribute_name,
-                value=setting_object.default,
-            )
-        if USE_CACHE:
-            cache.set(key, storage)
+            _refresh(key, using)
+        finally:
+            connections.close_all()
+    _spawn(refresh)
+
+
+def _fill(key):
+    """
+    Loads a key that is missing from the shared cache.
+
+    Only a single process at a time reloads a key. While it does, others serve
+    the value they've seen last, or wait a moment for the cache to be refilled.
+    """
+    from dbsettings.settings import USE_CACHE
+    if not USE_CACHE:
+        return _load_storage(*key)
+    if cache.add(_lock_key(key), True, LOAD_LOCK_TIMEOUT):
+        # The previous holder of the lock may have just refilled the cache
+        storage, _ = _get_cached(key)
+        if storage is not None:
+            cache.delete(_lock_key(key))
+            return storage
+        return _refresh(key)
+    previous = _last_seen.get(key)
+    if previous is not None:
+        return previous
+    deadline = time.time() + LOAD_WAIT_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(0.02)
+        storage, _ = _get_cached(key)
+        if storage is not None:
+            return storage
+    return _load_storage(*key)
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.storage = None
+
+
+def _load_single_flight(key):
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    if not leader:
+        flight.done.wait(LOAD_LOCK_TIMEOUT)
+        if flight.storage is not None:
+            return flight.storage
+        # The leader failed, so try on our own
+        return _fill(key)
+    try:
+        flight.storage = _fill(key)
+        return flight.storage
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+
+
+def get_settings_version():
+    """
+    Returns a number which changes whenever settings are changed.
+
+    Returns None when the cache is disabled.
+    """
+    from dbsettings.settings import USE_CACHE
+    if not USE_CACHE:
+        return None
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Start from the current time, rather than 0, so that a cache flush
+        # doesn't bring back a version number which was already used.
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _changes_key(version):
+    return 'dbsettings.changes.%d' % version
+
+
+def _bump_version(keys):
+    global _recent_version
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        get_settings_version()
+        version = cache.incr(VERSION_KEY)
+    cache.set(_changes_key(version), keys, CHANGES_TIMEOUT)
+    _recent_version = version
+
+
+def _get_recent_version():
+    """
+    Returns the settings version, read from the cache at most once every
+    PRELOAD_CHECK_INTERVAL seconds. Changes made by this process are seen at once.
+    """
+    from dbsettings.settings import USE_CACHE
+    global _recent_version, _recent_version_at
+    if not USE_CACHE:
+        return None
+    now = time.time()
+    if now - _recent_version_at >= PRELOAD_CHECK_INTERVAL:
+        _recent_version_at = now
+        _recent_version = get_settings_version()
+    return _recent_version
+
+
+def _sync_preload():
+    """
+    Marks preloaded settings, which were changed since, as stale.
+
+    If the changes can't be determined, the preloaded settings are dropped.
+    """
+    global _preload, _preload_version
+    version = get_settings_version()
+    if version == _preload_version:
+        return
+    if (version is not None and _preload_version is not None and
+            0 < version - _preload_version <= PRELOAD_MAX_CHANGES):
+        versions = range(_preload_version + 1, version + 1)
+        changes = cache.get_many([_changes_key(v) for v in versions])
+        if len(changes) == len(versions):
+            for keys in changes.values():
+                _preload_stale.update(tuple(key) for key in keys)
+            _preload_version = version
+            return
+    _preload = None
+
+
+# Returned by _get_preloaded_value() for settings which aren't preloaded
+_NOT_PRELOADED = object()
+
+
+def _get_preloaded_value(key):
+    "Returns the preloaded value of a setting, or _NOT_PRELOADED"
+    global _preload_checked_at
+    if _preload is None or _backend is not _preload_backend:
+        return _NOT_PRELOADED
+    now = time.time()
+    if now - _preload_checked_at >= PRELOAD_CHECK_INTERVAL:
+        _preload_checked_at = now
+        _sync_preload()
+    if _preload is None or key in _preload_stale:
+        return _NOT_PRELOADED
+    return _preload.get(key, _NOT_PRELOADED)
+
+
+def _get_database_storage(key):
+    from dbsettings.settings import CACHE_GROUPS, USE_CACHE
+    storage = _get_local(key)
+    if storage is not None:
+        if _profiling:
+            _request_state.source = 'local'
+        return storage
+    if USE_CACHE and CACHE_GROUPS:
+        storages, loaded = _get_group_storages([key])
+        storage = storages[key]
+        if _profiling:
+            _request_state.source = 'database' if loaded else 'cache'
+    elif USE_CACHE:
+        storage, stale = _get_cached(key)
+        if stale:
+            # Served stale while a fresh copy is loaded in the background
+            _revalidate(key)
+        if _profiling:
+            _request_state.source = 'cache'
+    if storage is None:
+        storage = _load_single_flight(key)
+        if _profiling:
+            _request_state.source = 'database'
+    _set_local(key, storage)
+    _last_seen[key] = storage
     return storage
 
 
+def _get_database_storages(keys):
+    from dbsettings.settings import CACHE_GROUPS, USE_CACHE
+    storages = {}
+    missing = []
+    for key in keys:
+        storage = _get_local(key)
+        if storage is None:
+            missing.append(key)
+        else:
+            storages[key] = storage
+    if missing and USE_CACHE and CACHE_GROUPS:
+        loaded, _ = _get_group_storages(missing)
+        missing = []
+        for key, storage in loaded.items():
+            _set_local(key, storage)
+        storages.update(loaded)
+    generations = None
+    if missing and USE_CACHE:
+        namespaces = dict((key, _namespace_keys(key)) for key in missing)
+        cache_keys = set(k for keys in namespaces.values() for k in keys)
+        generations = dict((k, None) for k in cache_keys)
+        cache_keys.update(_get_cache_key(*key) for key in missing)
+        entries = cache.get_many(list(cache_keys))
+        generations.update((k, entries[k]) for k in generations if k in entries)
+        keys, missing = missing, []
+        for key in keys:
+            tag = tuple(generations[k] for k in namespaces[key])
+            storage, stale = _unpack_cached(entries.get(_get_cache_key(*key)), tag)
+            if stale:
+                _revalidate(key)
+            if storage is None:
+                missing.append(key)
+            else:
+                storages[key] = storage
+                _set_local(key, storage)
+    if missing:
+        loaded = _load_storages(missing, _get_fill_database() if USE_CACHE else None)
+        if USE_CACHE:
+            _cache_storages(loaded, generations)
+        for key, storage in loaded.items():
+            _set_local(key, storage)
+        storages.update(loaded)
+    _last_seen.update(storages)
+    return storages
+
+
+def get_setting_storage(module_name, class_name, attribute_name):
+    return get_backend().get_storage((module_name, class_name, attribute_name))
+
+
+def get_setting_storages(keys):
+    """
+    Returns a dict of storages for all given setting keys, fetched with at most
+    one cache call and one query.
+    """
+    return get_backend().get_storages(list(keys))
+
+
 def register_setting(setting):
+    global _names
     if setting.key not in _settings:
         _settings[setting.key] = setting
+        _names = None
 
 
 def unregister_setting(setting):
+    global _names
     if setting.key in _settings and _settings[setting.key] is setting:
         del _settings[setting.key]
+        _names = None
 
 
-def set_setting_value(module_name, class_name, attribute_name, value):
-    from dbsettings.settings import USE_CACHE
+def get_setting_name(setting):
+    "Returns the name of the setting: app.Class.attribute, or app.attribute"
+    return '.'.join(n for n in (setting.app, setting.class_name, setting.attribute_name) if n)
+
+
+def get_setting_by_name(name):
+    "Returns the setting with the given name, see get_setting_name"
+    global _names
+    names = _names
+    if names is None:
+        names = _names = dict((get_setting_name(s), s) for s in list(_settings.values()))
+    return names[name]
+
+
+def _next_sequence(using):
+    """
+    Returns the next change sequence number.
+
+    The counter stays locked until the transaction is committed, so changes
+    become visible in the order of their sequence numbers. To keep that lock
+    short, writes take the number last, once they know something changed.
+    """
+    from dbsettings.models import ChangeSequence
+    counter = ChangeSequence.objects.using(using).filter(pk=1)
+    if not counter.update(value=F('value') + 1):
+        try:
+            with transaction.atomic(using=using):
+                ChangeSequence.objects.using(using).create(pk=1, value=1)
+            return 1
+        except IntegrityError:
+            # Created concurrently
+            return _next_sequence(using)
+    return counter.values_list('value', flat=True).get()
+
+
+def _get_change_sequence():
+    "Returns the sequence number of the latest change, read from the database"
+    from dbsettings.models import ChangeSequence
+    value = ChangeSequence.objects.using(get_read_database()).values_list('value', flat=True)
+    return value.first() or 0
+
+
+def _set_database_value(key, value, expected=None):
+    from dbsettings.models import Setting
+    using = get_write_database()
+    queryset = Setting.objects.using(using).filter(
+        module_name=key[0],
+        class_name=key[1],
+        attribute_name=key[2],
+    )
+    changed = queryset.exclude(value=value)
+    if expected is not None:
+        changed = changed.filter(version=expected)
+    with transaction.atomic(using=using, savepoint=False):
+        updated = changed.update(value=value, version=F('version') + 1)
+        if updated:
+            queryset.update(sequence=_next_sequence(using))
+        else:
+            # The setting is either not stored yet, unchanged, or changed by someone else
+            current = queryset.values_list('version', flat=True).first()
+            if current is None and not expected:
+                sequence = _next_sequence(using)
+                try:
+                    with transaction.atomic(using=using):
+                        Setting(module_name=key[0], class_name=key[1], attribute_name=key[2],
+                                value=value, version=1, sequence=sequence).save(using=using)
+                except IntegrityError:
+                    # Stored concurrently, so this is a change of that value now
+                    return _set_database_value(key, value, expected)
+                updated = True
+    if not updated:
+        if expected is not None and current != expected:
+            raise SettingConflict('%s was changed by someone else.' % '.'.join(key))
+        return False
+    pin_to_primary()
+    invalidate_cached_settings([key])
+    send_setting_changed([key], using)
+    return True
+
+
+def _prepare_value(setting, value):
+    """
+    Returns the value of the setting to be stored. ValueError is raised for
+    values which aren't one of the setting's choices, or can't be read back.
+    """
+    if not setting.is_valid_choice(value):
+        raise ValueError('%r is not one of the choices of %s.' % (value, '.'.join(setting.key)))
+    raw = setting.get_db_prep_save(value)
+    try:
+        setting.to_python(raw)
+    except Exception as e:
+        raise ValueError('%r is not a valid value of %s: %s' % (value, '.'.join(setting.key), e))
+    return raw
+
+
+def set_setting_value(module_name, class_name, attribute_name, value, expected=None):
+    """
+    Stores a new value of the setting. Returns whether it was changed.
+    ValueError is raised for values which aren't one of the setting's choices,
+    or which the setting can't read back.
+
+    If the expected version of the stored setting is given (0 for settings
+    which aren't stored yet), the value is only changed if the setting is
+    still at that version, and SettingConflict is raised otherwise.
+    """
+    setting = get_setting(module_name, class_name, attribute_name)
+    value = _prepare_value(setting, value)
+    if _profiling:
+        from dbsettings.profiling import profiled_set
+        return profiled_set(setting, value, expected)
+    return get_backend().set_value(setting.key, value, expected)
+
+
+def set_global_setting_value(module_name, class_name, attribute_name, value,
+                             clear_overrides=False):
+    """
+    Stores a new global value of the setting, used by all sites which don't
+    override it. With clear_overrides, values of individual sites are
+    deleted, so that the value applies to all sites.
+    """
+    from dbsettings.models import Setting
+    from dbsettings.settings import USE_SITES
+    if not USE_SITES:
+        return set_setting_value(module_name, class_name, attribute_name, value)
+    setting = get_setting(module_name, class_name, attribute_name)
+    value = _prepare_value(setting, value)
+    using = get_write_database()
+    queryset = Setting.all_sites.using(using).filter(
+        module_name=module_name,
+        class_name=class_name,
+        attribute_name=attribute_name,
+    )
+    global_rows = queryset.filter(site__isnull=True)
+    with transaction.atomic(using=using):
+        changed = global_rows.exclude(value=value).update(value=value, version=F('version') + 1)
+        # Deleted overrides change the value of their sites, so they're
+        # reported through the global row too, even if its value is unchanged
+        if clear_overrides and queryset.filter(site__isnull=False).delete()[0]:
+            changed = True
+        if changed or not global_rows.exists():
+            sequence = _next_sequence(using)
+            if not global_rows.update(sequence=sequence):
+                Setting(module_name=module_name, class_name=class_name,
+                        attribute_name=attribute_name, value=value, version=1,
+                        sequence=sequence).save(using=using, all_sites=True)
+            changed = True
+    if not changed:
+        return False
+    pin_to_primary()
+    invalidate_cached_settings([setting.key], all_sites=True)
+    send_setting_changed([setting.key], using)
+    return True
+
+
+def _increment_database_value(key, delta):
+    from dbsettings.models import Setting
+    setting = get_setting(*key)
+    using = get_write_database()
+    # Without row locks, e.g. on SQLite, taking the sequence first takes the
+    # database's write lock, so that the rows can't change before they're saved
+    sequence_first = not connections[using].features.has_select_for_update
+    try:
+        with transaction.atomic(using=using):
+            sequence = _next_sequence(using) if sequence_first else None
+            # The rows stay locked until the transaction is committed
+            queryset = Setting.objects.visible().using(using).select_for_update().filter(
+                module_name=key[0],
+                class_name=key[1],
+                attribute_name=key[2],
+            )
+            storage = _pick_storages(queryset).get(key)
+            if storage is None or storage.is_global:
+                # Start from the default or the global value, but save it for this site
+                value = storage.value if storage is not None else setting.default
+                storage = _get_default_storage(*key)
+                storage.value = value
+            value = (setting.to_python(storage.value) or 0) + delta
+            storage.value = setting.get_db_prep_save(value)
+            storage.version += 1
+            # Like other writes, lock the sequence after the rows, to avoid deadlocks
+            storage.sequence = sequence or _next_sequence(using)
+            storage.save(using=using)
+    except IntegrityError:
+        # Rows which aren't stored yet can't be locked, and another increment
+        # stored the setting first, so add to its value instead
+        return _increment_database_value(key, delta)
+    pin_to_primary()
+    invalidate_cached_settings([key])
+    send_setting_changed([key], using)
+    return value
+
+
+def increment_setting_value(module_name, class_name, attribute_name, delta=1):
+    """
+    Atomically adds delta to an IntegerValue or DecimalValue setting, without
+    losing concurrent updates. Returns the new value.
+    """
+    from dbsettings.values import DecimalValue, IntegerValue
     setting = get_setting(module_name, class_name, attribute_name)
-    storage = get_setting_storage(module_name, class_name, attribute_name)
-    storage.value = setting.get_db_prep_save(value)
-    storage.save()
+    if not isinstance(setting, (IntegerValue, DecimalValue)):
+        raise TypeError('Only IntegerValue and DecimalValue settings can be incremented.')
+    return get_backend().increment(setting.key, delta)
+
+
+def decrement_setting_value(module_name, class_name, attribute_name, delta=1):
+    "Atomically subtracts delta from a setting, see increment_setting_value"
+    return increment_setting_value(module_name, class_name, attribute_name, -delta)
+
+
+def get_changed_settings(since=None):
+    """
+    Returns (sequence, changes) where changes maps keys of settings changed
+    after the given sequence number to their current values. Without a
+    sequence number, all settings are returned, including ones which aren't
+    stored, along with the sequence number they're current as of.
+
+    Pass the returned sequence as since on the next call to only get settings
+    changed in the meantime.
+    """
+    from dbsettings.models import Setting
+    from dbsettings.settings import USE_SITES
+    queryset = Setting.objects.visible().using(get_read_database())
+    if since is None:
+        # Read with a single query, so the sequence matches the values
+        storages = list(queryset)
+        sequence = max([storage.sequence for storage in storages] or [0])
+        storages = dict((key, storage) for key, storage in _pick_storages(storages).items()
+                        if key in _settings)
+        for key in _settings:
+            if key not in storages:
+                storages[key] = _get_default_storage(*key)
+    else:
+        sequence = since
+        storages = {}
+        for storage in queryset.filter(sequence__gt=since).order_by('sequence'):
+            key = storage.module_name, storage.class_name, storage.attribute_name
+            sequence = storage.sequence
+            if key in _settings:
+                storages[key] = storage
+        if USE_SITES and storages:
+            # A changed global setting may still be overridden for this site
+            storages = _load_storages(storages)
+    changes = dict((key, _settings[key].decode(storage.value))
+                   for key, storage in storages.items())
+    return sequence, changes
+
+
+def invalidate_cached_settings(keys, all_sites=False):
+    """
+    Drops cached storages of all given setting keys at once, after they were
+    changed in the database. With all_sites, they're dropped for every site.
+    """
+    from dbsettings.settings import CACHE_GROUPS, USE_CACHE, USE_SITES
+    keys = list(keys)
+    for key in keys:
+        _local_cache.pop(key, None)
+        _last_seen.pop(key, None)
+    _preload_stale.update(keys)
     if USE_CACHE:
-        key = _get_cache_key(module_name, class_name, attribute_name)
-        cache.delete(key)
+        if all_sites and USE_SITES:
+            from django.contrib.sites.models import Site
+            site_ids = Site.objects.values_list('pk', flat=True)
+            cache.delete_many([_get_cache_key(*(key + (site_id,)))
+                               for key in keys for site_id in site_ids])
+        else:
+            cache.delete_many([_get_cache_key(*key) for key in keys])
+        if CACHE_GROUPS:
+            for group in set(key[:2] for key in keys):
+                try:
+                    cache.incr(_generation_key(group))
+                except ValueError:
+                    # Without a generation, no entry of the group is valid
+                    pass
+        _bump_version(keys)
+
+
+def invalidate_all_cached_settings(app_label=None, site_id=None):
+    """
+    Drops cached settings of the given app, of the given site, or of all
+    settings if neither is given, with a single cache call for each.
+
+    Cached entries are tagged with generations of these namespaces, and are
+    ignored once a generation is incremented.
+    """
+    from dbsettings.settings import USE_CACHE, USE_SITES
+    keys = [key for key in _settings if app_label is None or _settings[key].app == app_label]
+    for key in keys:
+        _local_cache.pop(key, None)
+        _last_seen.pop(key, None)
+    _preload_stale.update(keys)
+    if not USE_CACHE:
+        return
+    generation_keys = []
+    if app_label is not None:
+        generation_keys.append(_app_generation_key(app_label))
+    if site_id is not None and USE_SITES:
+        generation_keys.append(_site_generation_key(site_id))
+    if app_label is None and site_id is None:
+        generation_keys.append(GENERATION_KEY)
+    for generation_key in generation_keys:
+        try:
+            cache.incr(generation_key)
+        except ValueError:
+            # Without a generation, no entry of the namespace is valid
+            pass
+    _bump_version(keys)
+
+
+def send_setting_changed(keys, using=None):
+    """
+    Sends the setting_changed signal for the given keys, once the current
+    transaction of the given database is committed.
+    """
+    from dbsettings.signals import setting_changed
+    keys = list(keys)
+
+    def send():
+        setting_changed.send(sender=get_backend().__class__, keys=keys)
+    if using is None:
+        send()
+    else:
+        transaction.on_commit(send, using=using)
+
+
+def _load_storages(keys, using=None):
+    """
+    Returns storages of the given setting keys, fetched with a single query.
+    """
+    from dbsettings.models import Setting
+    keys = set(keys)
+    storages = {}
+    queryset = Setting.objects.visible().using(using or get_read_database()).filter(
+        module_name__in=set(key[0] for key in keys),
+        attribute_name__in=set(key[2] for key in keys),
+    )
+    for key, storage in _pick_storages(queryset).items():
+        if key in keys:
+            storages[key] = storage
+    for key in keys:
+        if key not in storages:
+            storages[key] = _get_default_storage(*key)
+    return storages
+
+
+def _load_all_storages(using=None):
+    """
+    Returns storages of all registered settings, fetched with a single query.
+    """
+    from dbsettings.models import Setting
+    storages = {}
+    queryset = Setting.objects.visible().using(using or get_read_database())
+    for key, storage in _pick_storages(queryset).items():
+        if key in _settings:
+            storages[key] = storage
+    for key in _settings:
+        if key not in storages:
+            storages[key] = _get_default_storage(*key)
+    return storages
+
+
+def warm_cache():
+    """
+    Caches storages of all registered settings, fetched with a single query.
+
+    Returns the number of cached settings.
+    """
+    from dbsettings.settings import CACHE_GROUPS, USE_CACHE
+    if USE_CACHE and CACHE_GROUPS:
+        groups = dict((key[:2], key) for key in _settings)
+        generations = _get_generations(set(
+            k for group, key in groups.items() for k in _group_generation_keys(group, key)))
+    storages = _load_all_storages(_get_fill_database() if USE_CACHE else None)
+    if USE_CACHE and CACHE_GROUPS:
+        _cache_groups(storages, generations)
+    elif USE_CACHE:
+        _cache_storages(storages)
+    for key, storage in storages.items():
+        _set_local(key, storage)
+    return len(storages)
+
+
+def preload(freeze=True):
+    """
+    Loads and decodes all registered settings into memory of this process,
+    to be called in the master process of a pre-fork server (e.g. from a
+    gunicorn config with preload_app = True).
+
+    Forked workers share the decoded values and read them without any
+    queries, cache calls or decoding. Only the settings version is checked, at most
+    once every PRELOAD_CHECK_INTERVAL seconds, and settings changed since
+    preloading are read the regular way.
+
+    With freeze, objects allocated so far are moved out of reach of the
+    garbage collector (Python 3.7+), so that collections in the workers
+    don't copy the shared memory pages.
+
+    Returns the number of preloaded settings.
+    """
+    from django.core.exceptions import ImproperlyConfigured
+    from dbsettings.settings import USE_CACHE
+    global _preload, _preload_backend, _preload_version, _preload_checked_at
+    from dbsettings.backends import DatabaseBackend
+    if not USE_CACHE:
+        raise ImproperlyConfigured('Preloading settings requires DBSETTINGS_USE_CACHE.')
+    if not isinstance(get_backend(), DatabaseBackend):
+        raise ImproperlyConfigured('Preloading settings requires the database backend.')
+    version = get_settings_version()
+    storages = _load_all_storages()
+    _preload = dict((key, _settings[key].decode(storage.value))
+                    for key, storage in storages.items())
+    _preload_backend, _preload_version = get_backend(), version
+    _preload_stale.clear()
+    _preload_checked_at = time.time()
+    if freeze and hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+    return len(storages)
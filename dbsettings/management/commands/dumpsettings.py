@@ -0,0 +1,98 @@
+import io
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dbsettings import loading
+from dbsettings.models import Setting
+from dbsettings.settings import USE_SITES
+
+
+class Command(BaseCommand):
+    help = ('Output stored values of registered settings as JSON Lines, '
+            'one setting per line.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'args', metavar='app_label', nargs='*',
+            help='Restricts dumped settings to the specified app_labels.',
+        )
+        parser.add_argument(
+            '-o', '--output', default=None, dest='output',
+            help='Specifies file to which the output is written.',
+        )
+        parser.add_argument(
+            '--site', default=None, dest='site', type=int,
+            help='Dump settings of the site with the given id only.',
+        )
+        parser.add_argument(
+            '--defaults', action='store_true', dest='defaults', default=False,
+            help='Also dump settings without stored values, with their defaults.',
+        )
+
+    def handle(self, *app_labels, **options):
+        if app_labels:
+            settings = [s for s in loading.get_all_settings() if s.app in app_labels]
+            if not settings:
+                raise CommandError('No settings registered for %s.' % ', '.join(app_labels))
+        else:
+            settings = loading.get_all_settings()
+        registered = dict((s.key, s) for s in settings)
+
+        queryset = Setting.all_sites.filter(
+            module_name__in=set(s.module_name for s in settings),
+        ).order_by('pk')
+        if USE_SITES and options['site'] is not None:
+            queryset = queryset.filter(site=options['site'])
+
+        output = options['output']
+        stream = io.open(output, 'w', encoding='utf-8') if output else None
+        try:
+            count = 0
+            stored = set()
+            for storage in queryset.iterator():
+                key = storage.module_name, storage.class_name, storage.attribute_name
+                if key not in registered:
+                    continue
+                stored.add(key)
+                record = self.make_record(registered[key], storage.value,
+                                          storage.site_id if USE_SITES else None)
+                if storage.is_global:
+                    # Shared by all sites
+                    record['global'] = True
+                self.write(stream, record)
+                count += 1
+            if options['defaults']:
+                for setting in settings:
+                    if setting.key not in stored:
+                        value = setting.default
+                        if value is not None:
+                            value = setting.get_db_prep_save(value)
+                        record = self.make_record(setting, value,
+                                                  options['site'] if USE_SITES else None)
+                        # Skipped by loadsettings
+                        record['default'] = True
+                        self.write(stream, record)
+                        count += 1
+        finally:
+            if stream:
+                stream.close()
+        if output and options['verbosity'] >= 1:
+            self.stderr.write('Dumped %d setting(s).' % count)
+
+    def make_record(self, setting, value, site):
+        return {
+            'module_name': setting.module_name,
+            'class_name': setting.class_name,
+            'attribute_name': setting.attribute_name,
+            'type': setting.__class__.__name__,
+            'value': value,
+            'site': site,
+        }
+
+    def write(self, stream, record):
+        line = json.dumps(record, sort_keys=True)
+        if stream:
+            stream.write(u'%s\n' % line)
+        else:
+            self.stdout.write(line)
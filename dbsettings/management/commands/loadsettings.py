@@ -0,0 +1,196 @@
+import io
+import json
+import sys
+
+from django.conf import settings as django_settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+
+from dbsettings import loading
+from dbsettings.models import Setting
+from dbsettings.settings import USE_SITES
+
+# Marks rows written by this load until they get their change sequence number,
+# shared by all settings loaded at once. Rows written by concurrent loads
+# aren't visible to this one before they're committed with their own number.
+PENDING_SEQUENCE = -1
+
+
+class Command(BaseCommand):
+    help = ('Installs setting values from a JSON Lines file created by dumpsettings. '
+            'Values are validated by their setting type and applied in batches '
+            'within a single transaction.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'input', metavar='file',
+            help='JSON Lines file to load, or "-" to read from stdin.',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Report the changes without writing them to the database.',
+        )
+        parser.add_argument(
+            '--batch-size', default=500, dest='batch_size', type=int,
+            help='Number of settings looked up and written at once.',
+        )
+        parser.add_argument(
+            '--site', default=None, dest='site', type=int,
+            help='Load all settings into the site with the given id, '
+                 'regardless of the site stored in the file.',
+        )
+        parser.add_argument(
+            '-i', '--ignorenonexistent', action='store_true', dest='ignore', default=False,
+            help='Ignores entries for settings that are not registered.',
+        )
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.verbosity = options['verbosity']
+        self.site = options['site']
+        self.ignore = options['ignore']
+        self.stats = {'added': 0, 'changed': 0, 'unchanged': 0}
+        self.changed_keys = set()
+        self.using = loading.get_write_database()
+
+        if options['input'] == '-':
+            stream = sys.stdin
+        else:
+            try:
+                stream = io.open(options['input'], encoding='utf-8')
+            except IOError as e:
+                raise CommandError('Unable to open %s: %s' % (options['input'], e))
+
+        try:
+            with transaction.atomic(using=self.using):
+                batch = []
+                for lineno, line in enumerate(stream, 1):
+                    if not line.strip():
+                        continue
+                    record = self.parse(lineno, line)
+                    if record is not None:
+                        batch.append(record)
+                    if len(batch) >= options['batch_size']:
+                        self.apply(batch)
+                        batch = []
+                if batch:
+                    self.apply(batch)
+                if self.changed_keys and not self.dry_run:
+                    # The change sequence stays locked until the transaction is
+                    # committed, so it's taken last, with a single query.
+                    Setting.all_sites.using(self.using).filter(
+                        sequence=PENDING_SEQUENCE).update(
+                            sequence=loading._next_sequence(self.using))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        if self.changed_keys and not self.dry_run:
+            loading.pin_to_primary()
+            loading.invalidate_cached_settings(self.changed_keys)
+            loading.send_setting_changed(self.changed_keys, self.using)
+
+        if self.verbosity >= 1:
+            self.stdout.write('%s%d setting(s) added, %d changed, %d unchanged.' % (
+                'Dry run: ' if self.dry_run else '',
+                self.stats['added'], self.stats['changed'], self.stats['unchanged'],
+            ))
+
+    def parse(self, lineno, line):
+        try:
+            data = json.loads(line)
+            key = data['module_name'], data['class_name'], data['attribute_name']
+            value = data['value']
+        except (ValueError, KeyError, TypeError) as e:
+            raise CommandError('Line %d: malformed entry (%s).' % (lineno, e))
+        if data.get('default'):
+            # Dumped with --defaults, not stored
+            return None
+
+        try:
+            setting = loading.get_setting(*key)
+        except KeyError:
+            if self.ignore:
+                return None
+            raise CommandError('Line %d: setting %s is not registered.' % (lineno, '.'.join(key)))
+        if data.get('type', setting.__class__.__name__) != setting.__class__.__name__:
+            raise CommandError('Line %d: %s is a %s, not a %s.' % (
+                lineno, '.'.join(key), setting.__class__.__name__, data['type']))
+        try:
+            setting.to_python(value)
+        except Exception as e:
+            raise CommandError('Line %d: invalid value for %s: %s' % (lineno, '.'.join(key), e))
+        if not setting.is_valid_choice(value):
+            raise CommandError('Line %d: %r is not one of the choices of %s.' % (
+                lineno, value, '.'.join(key)))
+
+        if not USE_SITES:
+            site = None
+        elif self.site is not None:
+            site = self.site
+        elif data.get('global'):
+            # Shared by all sites
+            site = None
+        else:
+            site = data.get('site') or django_settings.SITE_ID
+        return key, site, value
+
+    def apply(self, batch):
+        existing = {}
+        queryset = Setting.all_sites.using(self.using).filter(
+            module_name__in=set(key[0] for key, _, _ in batch),
+            attribute_name__in=set(key[2] for key, _, _ in batch),
+        )
+        if USE_SITES:
+            sites = Q(site__in=set(site for _, site, _ in batch if site is not None))
+            if any(site is None for _, site, _ in batch):
+                sites |= Q(site__isnull=True)
+            queryset = queryset.filter(sites)
+        for storage in queryset:
+            key = storage.module_name, storage.class_name, storage.attribute_name
+            existing[key, storage.site_id if USE_SITES else None] = storage
+
+        new = []
+        changed = {}
+        for key, site, value in batch:
+            storage = existing.get((key, site))
+            if storage is None:
+                self.report('+', key, site, value)
+                self.stats['added'] += 1
+                storage = Setting(module_name=key[0], class_name=key[1],
+                                  attribute_name=key[2], value=value, version=1)
+                if not self.dry_run:
+                    storage.sequence = PENDING_SEQUENCE
+                if USE_SITES:
+                    storage.site_id = site
+                new.append(storage)
+                existing[key, site] = storage
+            elif storage.value != value:
+                self.report('~', key, site, storage.value, value)
+                self.stats['changed'] += 1
+                if storage.pk is not None:
+                    changed[storage.pk] = value
+                storage.value = value
+            else:
+                self.stats['unchanged'] += 1
+                continue
+            self.changed_keys.add(key)
+
+        if self.dry_run:
+            return
+        if changed:
+            # A single query for all changed rows of the batch
+            whens = [When(pk=pk, then=Value(value)) for pk, value in changed.items()]
+            Setting.all_sites.using(self.using).filter(pk__in=list(changed)).update(
+                value=Case(*whens, output_field=Setting._meta.get_field('value')),
+                version=F('version') + 1, sequence=PENDING_SEQUENCE)
+        if new:
+            Setting.all_sites.db_manager(self.using).bulk_create(new)
+
+    def report(self, change, key, site, *values):
+        if self.verbosity < 1:
+            return
+        location = '.'.join(key) if site is None else '%s (site %s)' % ('.'.join(key), site)
+        self.stdout.write('%s %s: %s' % (change, location, ' -> '.join(
+            json.dumps(v) for v in values)))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dbsettings.backends import write_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Writes all stored settings to a snapshot file, to be served by SnapshotBackend.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=None,
+            help='Snapshot file to write. Defaults to DBSETTINGS_SNAPSHOT_FILE.',
+        )
+
+    def handle(self, *args, **options):
+        from dbsettings.settings import SNAPSHOT_FILE
+        path = options['path'] or SNAPSHOT_FILE
+        if not path:
+            raise CommandError('No path given and DBSETTINGS_SNAPSHOT_FILE is not set.')
+        count = write_snapshot(path)
+        if options['verbosity'] >= 1:
+            self.stdout.write('Written %d setting(s) to %s.' % (count, path))
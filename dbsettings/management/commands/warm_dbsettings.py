@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from dbsettings.loading import warm_cache
+
+
+class Command(BaseCommand):
+    help = 'Loads all registered settings from the database into the cache.'
+
+    def handle(self, *args, **options):
+        count = warm_cache()
+        if options['verbosity'] >= 1:
+            self.stdout.write('Cached %d setting(s).' % count)
@@ -0,0 +1,66 @@
+import logging
+import time
+
+try:
+    from django.utils.deprecation import MiddlewareMixin
+except ImportError:
+    MiddlewareMixin = object
+
+from dbsettings import loading
+from dbsettings.profiling import SettingsProfile
+
+logger = logging.getLogger('dbsettings')
+
+
+class ReadYourWritesMiddleware(MiddlewareMixin):
+    """
+    Keeps reading settings from the primary database for the rest of a user's
+    session, when settings were changed by one of their requests and
+    DBSETTINGS_READ_DATABASE points to a replica.
+    """
+    cookie_name = 'dbsettings_pinned'
+
+    def process_request(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(self.cookie_name, 0))
+        except ValueError:
+            pinned_until = 0
+        loading._request_state.pinned = pinned_until > time.time()
+        loading._request_state.wrote = False
+
+    def process_response(self, request, response):
+        from dbsettings.settings import REPLICATION_LAG
+        if getattr(loading._request_state, 'wrote', False):
+            response.set_cookie(self.cookie_name, str(time.time() + REPLICATION_LAG),
+                                max_age=REPLICATION_LAG, httponly=True)
+        loading._request_state.pinned = loading._request_state.wrote = False
+        return response
+
+
+class SettingsProfileMiddleware(MiddlewareMixin):
+    """
+    Logs a warning for requests reading settings more than
+    DBSETTINGS_PROFILE_MAX_READS times, or spending more than
+    DBSETTINGS_PROFILE_MAX_TIME seconds on settings, with the most used ones.
+    """
+    summary_length = 5
+
+    def process_request(self, request):
+        request._dbsettings_profile = SettingsProfile()
+        request._dbsettings_profile.start()
+
+    def process_response(self, request, response):
+        from dbsettings.settings import PROFILE_MAX_READS, PROFILE_MAX_TIME
+        profile = getattr(request, '_dbsettings_profile', None)
+        if profile is None:
+            return response
+        profile.stop()
+        del request._dbsettings_profile
+        if ((PROFILE_MAX_READS is not None and profile.reads > PROFILE_MAX_READS) or
+                (PROFILE_MAX_TIME is not None and profile.duration > PROFILE_MAX_TIME)):
+            used = ', '.join('%s (%d)' % ('.'.join(key), calls) for key, calls, _, _
+                             in profile.summary()[:self.summary_length])
+            logger.warning('%s %s read settings %d times in %.1f ms, most used: %s',
+                           request.method, request.path, profile.reads,
+                           profile.duration * 1000, used)
+        return response
@@ -20,7 +20,7 @@ class Migration(migrations.Migration):
                 ('module_name', models.CharField(max_length=255)),
                 ('class_name', models.CharField(max_length=255, blank=True)),
                 ('attribute_name', models.CharField(max_length=255)),
-                ('value', models.CharField(max_length=VALUE_LENGTH, blank=True)),
+                ('value', models.CharField(max_length=VALUE_LENGTH or 255, blank=True)),
             ] + ([('site', models.ForeignKey(to='sites.Site'))] if USE_SITES else [])
         ),
     ]
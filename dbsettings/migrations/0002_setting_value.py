@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from dbsettings.settings import VALUE_LENGTH
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbsettings', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='setting',
+            name='value',
+            field=(models.CharField(max_length=VALUE_LENGTH, blank=True) if VALUE_LENGTH
+                   else models.TextField(blank=True)),
+        ),
+    ]
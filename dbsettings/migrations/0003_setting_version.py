@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbsettings', '0002_setting_value'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='setting',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from dbsettings.settings import USE_SITES
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbsettings', '0004_setting_sequence'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='setting',
+            index_together=set([('module_name', 'class_name', 'attribute_name')]),
+        ),
+    ]
+    if USE_SITES:
+        operations.append(migrations.AlterField(
+            model_name='setting',
+            name='site',
+            field=models.ForeignKey(blank=True, null=True, to='sites.Site'),
+        ))
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def number_settings(apps, schema_editor):
+    """
+    Gives settings stored before the change feed a change sequence number, so
+    that they're part of the feed, and seeds the counter past it.
+    """
+    Setting = apps.get_model('dbsettings', 'Setting')
+    ChangeSequence = apps.get_model('dbsettings', 'ChangeSequence')
+    using = schema_editor.connection.alias
+    counter = ChangeSequence.objects.using(using).filter(pk=1).first()
+    sequence = (counter.value if counter is not None else 0) + 1
+    if Setting.objects.using(using).filter(sequence=0).update(sequence=sequence):
+        ChangeSequence.objects.using(using).update_or_create(pk=1, defaults={'value': sequence})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbsettings', '0005_setting_global'),
+    ]
+
+    operations = [
+        migrations.RunPython(number_settings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count
+
+from dbsettings.settings import USE_SITES
+
+if USE_SITES:
+    UNIQUE_FIELDS = ('module_name', 'class_name', 'attribute_name', 'site')
+else:
+    UNIQUE_FIELDS = ('module_name', 'class_name', 'attribute_name')
+
+
+def remove_duplicates(apps, schema_editor):
+    "Keeps only the most recently changed row of settings stored more than once"
+    Setting = apps.get_model('dbsettings', 'Setting')
+    settings = Setting.objects.using(schema_editor.connection.alias)
+    duplicates = settings.values(*UNIQUE_FIELDS).annotate(rows=Count('pk')).filter(rows__gt=1)
+    for row in duplicates:
+        del row['rows']
+        rows = settings.filter(**row).order_by('-sequence', '-version', '-pk')
+        rows.exclude(pk=rows.values_list('pk', flat=True)[0]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbsettings', '0006_number_settings'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='setting',
+            unique_together=set([UNIQUE_FIELDS]),
+        ),
+    ]
@@ -1,31 +1,90 @@
-from django.db import models
+from django.db import models, router
 
 from dbsettings.settings import USE_SITES, VALUE_LENGTH
 
+
+class SettingManager(models.Manager):
+    def visible(self):
+        "Settings which apply to the current site, see SiteSettingManager"
+        return self.get_queryset()
+
+
 if USE_SITES:
     from django.contrib.sites.models import Site
+    from django.db.models import Q
 
-    class SiteSettingManager(models.Manager):
+    class SiteSettingManager(SettingManager):
         def get_queryset(self):
             sup = super(SiteSettingManager, self)
             qs = sup.get_queryset() if hasattr(sup, 'get_queryset') else sup.get_query_set()
             return qs.filter(site=Site.objects.get_current())
         get_query_set = get_queryset
 
+        def visible(self):
+            """
+            Settings of the current site, along with global ones (without a
+            site), which apply to sites that don't override them.
+            """
+            qs = super(SiteSettingManager, self).get_queryset()
+            return qs.filter(Q(site=Site.objects.get_current()) | Q(site__isnull=True))
+
 
 class Setting(models.Model):
     module_name = models.CharField(max_length=255)
     class_name = models.CharField(max_length=255, blank=True)
     attribute_name = models.CharField(max_length=255)
-    value = models.CharField(max_length=VALUE_LENGTH, blank=True)
+    if VALUE_LENGTH:
+        value = models.CharField(max_length=VALUE_LENGTH, blank=True)
+    else:
+        value = models.TextField(blank=True)
+    # Incremented on every change, for detecting concurrent modifications
+    version = models.PositiveIntegerField(default=0)
+    # Value of ChangeSequence at the last change, for the change feed
+    sequence = models.BigIntegerField(default=0, db_index=True)
 
     if USE_SITES:
-        site = models.ForeignKey(Site)
+        # Settings without a site are global, shared by all sites
+        site = models.ForeignKey(Site, null=True, blank=True)
         objects = SiteSettingManager()
+        # Unfiltered access to settings of every site, used by bulk operations
+        all_sites = models.Manager()
+
+    else:
+        objects = SettingManager()
+        all_sites = models.Manager()
 
-        def save(self, *args, **kwargs):
-            self.site = Site.objects.get_current()
-            return super(Setting, self).save(*args, **kwargs)
+    def save(self, *args, **kwargs):
+        if USE_SITES:
+            # Global settings are saved with all_sites=True
+            if kwargs.pop('all_sites', False):
+                self.site = None
+            else:
+                self.site = Site.objects.get_current()
+        if not self.sequence:
+            # Saved without going through dbsettings, e.g. in the admin, but
+            # still part of the change feed
+            from dbsettings.loading import _next_sequence
+            using = kwargs.get('using') or router.db_for_write(Setting, instance=self)
+            self.sequence = _next_sequence(using)
+        return super(Setting, self).save(*args, **kwargs)
+
+    class Meta:
+        index_together = [('module_name', 'class_name', 'attribute_name')]
+        # A single row per setting (and site), even when first stored concurrently
+        if USE_SITES:
+            unique_together = [('module_name', 'class_name', 'attribute_name', 'site')]
+        else:
+            unique_together = [('module_name', 'class_name', 'attribute_name')]
 
     def __bool__(self):
         return self.pk is not None
+
+    @property
+    def is_global(self):
+        "Whether this is a stored global setting, shared by all sites"
+        return USE_SITES and self.pk is not None and self.site_id is None
+
+
+class ChangeSequence(models.Model):
+    "Single row counter, incremented by every change of settings"
+    value = models.BigIntegerField(default=0)
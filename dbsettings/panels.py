@@ -0,0 +1,49 @@
+from django.utils.translation import ugettext_lazy as _, ungettext
+
+from debug_toolbar.panels import Panel
+
+from dbsettings.profiling import SettingsProfile
+
+
+class SettingsPanel(Panel):
+    """
+    django-debug-toolbar panel listing the settings used by a request, with
+    the number of reads, their sources and the time spent on them.
+    """
+    title = _('Database settings')
+    template = 'dbsettings/panels/settings.html'
+
+    @property
+    def nav_subtitle(self):
+        stats = self.get_stats()
+        if not stats:
+            return ''
+        return ungettext('%(reads)d read in %(time).1f ms',
+                         '%(reads)d reads in %(time).1f ms',
+                         stats['reads']) % stats
+
+    def enable_instrumentation(self):
+        self.profile = SettingsProfile()
+        self.profile.start()
+
+    def disable_instrumentation(self):
+        self.profile.stop()
+
+    def generate_stats(self, request, response):
+        self.record_stats({
+            'reads': self.profile.reads,
+            'writes': self.profile.writes,
+            'time': self.profile.duration * 1000,
+            'settings': [{
+                'name': '.'.join(part for part in key if part),
+                'calls': calls,
+                'time': duration * 1000,
+                'sources': ', '.join('%s: %d' % s for s in sorted(sources.items())),
+            } for key, calls, duration, sources in self.profile.summary()],
+            'calls': [{
+                'operation': operation,
+                'name': '.'.join(part for part in key if part),
+                'source': source or '',
+                'time': duration * 1000,
+            } for operation, key, source, duration in self.profile.calls],
+        })
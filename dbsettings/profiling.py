@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import defaultdict
+
+from django.core.exceptions import ImproperlyConfigured
+
+from dbsettings import loading
+
+__all__ = ['SettingsProfile']
+
+_lock = threading.Lock()
+
+
+class SettingsProfile(object):
+    """
+    Records reads and writes of settings made by the current thread while it's
+    active, with their source and duration::
+
+        with SettingsProfile() as profile:
+            ...
+        print(profile.reads, profile.duration)
+
+    Sources of reads are 'preload', 'local', 'cache', 'database', 'default'
+    (for settings which aren't stored), or the name of the storage backend.
+    """
+
+    def __init__(self):
+        # (operation, key, source, duration in seconds) of each call
+        self.calls = []
+        self._parent = None
+
+    def start(self):
+        self._parent = getattr(loading._request_state, 'profile', None)
+        loading._request_state.profile = self
+        with _lock:
+            loading._profiling += 1
+
+    def stop(self):
+        loading._request_state.profile = self._parent
+        with _lock:
+            loading._profiling -= 1
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def record(self, operation, key, source, duration):
+        profile = self
+        while profile is not None:
+            profile.calls.append((operation, key, source, duration))
+            profile = profile._parent
+
+    @property
+    def reads(self):
+        return sum(1 for call in self.calls if call[0] == 'get')
+
+    @property
+    def writes(self):
+        return sum(1 for call in self.calls if call[0] == 'set')
+
+    @property
+    def duration(self):
+        return sum(call[3] for call in self.calls)
+
+    def summary(self):
+        """
+        Returns (key, calls, duration, sources) for each setting used, the most
+        used first. sources maps sources to the number of reads from them.
+        """
+        stats = defaultdict(lambda: [0, 0.0, defaultdict(int)])
+        for operation, key, source, duration in self.calls:
+            stat = stats[key]
+            stat[0] += 1
+            stat[1] += duration
+            stat[2][source] += 1
+        return sorted(((key, calls, duration, dict(sources))
+                       for key, (calls, duration, sources) in stats.items()),
+                      key=lambda s: (-s[1], s[0]))
+
+
+def _get_profile():
+    return getattr(loading._request_state, 'profile', None)
+
+
+def profiled_get(setting):
+    "Reads the setting like Value.__get__, recording the read"
+    profile = _get_profile()
+    loading._request_state.source = None
+    start = time.time()
+    storage = None
+    value = loading._get_preloaded_value(setting.key)
+    if value is not loading._NOT_PRELOADED:
+        loading._request_state.source = 'preload'
+    else:
+        try:
+            storage = loading.get_setting_storage(*setting.key)
+        except ImproperlyConfigured:
+            raise
+        except Exception:
+            value = None
+        else:
+            value = setting.decode(storage.value)
+    duration = time.time() - start
+    if profile is not None:
+        # Only set by the database backend
+        source = loading._request_state.source
+        if source is None:
+            source = loading.get_backend().__class__.__name__
+        elif storage is not None and storage.pk is None:
+            source = 'default'
+        profile.record('get', setting.key, source, duration)
+    return value
+
+
+def profiled_set(setting, value, expected=None):
+    "Stores the prepared value of the setting like set_setting_value, recording the write"
+    profile = _get_profile()
+    start = time.time()
+    try:
+        return loading.get_backend().set_value(setting.key, value, expected)
+    finally:
+        if profile is not None:
+            profile.record('set', setting.key, None, time.time() - start)
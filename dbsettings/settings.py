@@ -1,8 +1,22 @@
 from django.apps import apps
 from django.conf import settings
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
 
 
 sites_installed = apps.is_installed('django.contrib.sites')
 USE_SITES = getattr(settings, 'DBSETTINGS_USE_SITES', sites_installed)
 USE_CACHE = getattr(settings, 'DBSETTINGS_USE_CACHE', True)
 VALUE_LENGTH = getattr(settings, 'DBSETTINGS_VALUE_LENGTH', 255)
+LOCAL_CACHE_TIMEOUT = getattr(settings, 'DBSETTINGS_LOCAL_CACHE_TIMEOUT', 0)
+WARM_CACHE = getattr(settings, 'DBSETTINGS_WARM_CACHE', False)
+CACHE_TIMEOUT = getattr(settings, 'DBSETTINGS_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+STALE_WHILE_REVALIDATE = getattr(settings, 'DBSETTINGS_STALE_WHILE_REVALIDATE', False)
+CACHE_GROUPS = getattr(settings, 'DBSETTINGS_CACHE_GROUPS', False)
+READ_DATABASE = getattr(settings, 'DBSETTINGS_READ_DATABASE', None)
+REPLICATION_LAG = getattr(settings, 'DBSETTINGS_REPLICATION_LAG', 5)
+BACKEND = getattr(settings, 'DBSETTINGS_BACKEND', 'dbsettings.backends.DatabaseBackend')
+SNAPSHOT_FILE = getattr(settings, 'DBSETTINGS_SNAPSHOT_FILE', None)
+EDITOR_PAGE_SIZE = getattr(settings, 'DBSETTINGS_EDITOR_PAGE_SIZE', 100)
+API_TOKEN = getattr(settings, 'DBSETTINGS_API_TOKEN', None)
+PROFILE_MAX_READS = getattr(settings, 'DBSETTINGS_PROFILE_MAX_READS', 100)
+PROFILE_MAX_TIME = getattr(settings, 'DBSETTINGS_PROFILE_MAX_TIME', 0.05)
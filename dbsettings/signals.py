@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent after settings were changed and the change was committed, with the keys
+# of all settings changed together, e.g. by loadsettings, as keys.
+setting_changed = Signal(providing_args=['keys'])
@@ -0,0 +1,120 @@
+from django import template
+from django.utils.html import conditional_escape
+
+from dbsettings import loading
+
+register = template.Library()
+
+
+def _get_values(context, node):
+    """
+    Returns a dict with the values of all settings read in the current render.
+    If the node's settings aren't known yet, those of all tags of its template
+    are fetched at once.
+    """
+    values = getattr(context, '_dbsettings_values', None)
+    if values is None:
+        values = context._dbsettings_values = {}
+    if all(name in values for name in node.get_names()):
+        return values
+    missing = []
+    for template_node in node.template_nodes:
+        missing.extend(name for name in template_node.get_names()
+                       if name not in values and name not in missing)
+    settings = []
+    for name in missing:
+        try:
+            settings.append(loading.get_setting_by_name(name))
+        except KeyError:
+            raise template.TemplateSyntaxError('There is no setting named %r.' % name)
+    storages = loading.get_setting_storages(s.key for s in settings)
+    for name, setting in zip(missing, settings):
+        values[name] = setting.decode(storages[setting.key].value)
+    return values
+
+
+class SettingNodeBase(template.Node):
+    def __init__(self, name, asvar, template_nodes):
+        self.name = name
+        self.asvar = asvar
+        # Nodes of all settings tags of the same template, including those of
+        # its blocks, shared by them and completed once the template is parsed
+        self.template_nodes = template_nodes
+        template_nodes.append(self)
+
+    def get_names(self):
+        raise NotImplementedError
+
+    def render(self, context):
+        value = self.get_value(_get_values(context, self))
+        if self.asvar:
+            context[self.asvar] = value
+            return ''
+        if context.autoescape:
+            value = conditional_escape(value)
+        return value
+
+
+class SettingNode(SettingNodeBase):
+    def get_names(self):
+        return [self.name]
+
+    def get_value(self, values):
+        return values[self.name]
+
+
+class GroupNode(SettingNodeBase):
+    _names = None
+
+    def get_names(self):
+        # Looked up in all settings again only when settings were registered since
+        count = len(loading._settings)
+        if self._names is None or self._names[0] != count:
+            names = (loading.get_setting_name(s) for s in loading.get_all_settings())
+            self._names = count, [name for name in names if name.rsplit('.', 1)[0] == self.name]
+        return self._names[1]
+
+    def get_value(self, values):
+        prefix = self.name + '.'
+        return dict((name[len(prefix):], values[name]) for name in self.get_names())
+
+
+def _parse(parser, token, node_class):
+    bits = token.split_contents()
+    if len(bits) == 2:
+        asvar = None
+    elif len(bits) == 4 and bits[2] == 'as':
+        asvar = bits[3]
+    else:
+        raise template.TemplateSyntaxError(
+            "'%s' takes a quoted name, optionally followed by 'as variable'." % bits[0])
+    name = bits[1]
+    if len(name) < 2 or name[0] != name[-1] or name[0] not in ('"', "'"):
+        raise template.TemplateSyntaxError("'%s' requires a quoted name." % bits[0])
+    if not hasattr(parser, '_dbsettings_nodes'):
+        parser._dbsettings_nodes = []
+    return node_class(name[1:-1], asvar, parser._dbsettings_nodes)
+
+
+@register.tag
+def dbsetting(parser, token):
+    """
+    Outputs the value of a setting, or stores it in a variable::
+
+        {% dbsetting "myapp.ImageLimits.maximum_width" %}
+        {% dbsetting "myapp.ImageLimits.maximum_width" as width %}
+
+    Values of all settings used by the tags of a template are fetched at once.
+    """
+    return _parse(parser, token, SettingNode)
+
+
+@register.tag
+def dbsettings_group(parser, token):
+    """
+    Stores a dict of all values of a group of settings in a variable::
+
+        {% dbsettings_group "myapp.ImageLimits" as limits %}
+        {{ limits.maximum_width }}
+    """
+    return _parse(parser, token, GroupNode)
@@ -0,0 +1,100 @@
+from functools import wraps
+
+from dbsettings import loading
+from dbsettings.backends import MemoryBackend
+
+__all__ = ['override_dbsettings']
+
+
+class OverrideBackend(MemoryBackend):
+    "Serves overridden settings from memory, and all others from another backend"
+
+    def __init__(self, backend, values):
+        super(OverrideBackend, self).__init__()
+        self.backend = backend
+        self.values.update(values)
+
+    def get_storage(self, key):
+        if key in self.values:
+            return super(OverrideBackend, self).get_storage(key)
+        return self.backend.get_storage(key)
+
+    def get_storages(self, keys):
+        keys = list(keys)
+        storages = self.backend.get_storages([key for key in keys if key not in self.values])
+        for key in keys:
+            if key in self.values:
+                storages[key] = super(OverrideBackend, self).get_storage(key)
+        return storages
+
+    def set_value(self, key, value, expected=None):
+        if key in self.values:
+            return super(OverrideBackend, self).set_value(key, value, expected)
+        return self.backend.set_value(key, value, expected)
+
+    def increment(self, key, delta):
+        if key in self.values:
+            return super(OverrideBackend, self).increment(key, delta)
+        return self.backend.increment(key, delta)
+
+
+class override_dbsettings(object):
+    """
+    Overrides settings of a group for the duration of a with block, a test
+    function, or all tests of a TestCase::
+
+        @override_dbsettings(ImageLimits.settings, maximum_width=800)
+        def test_resize(self):
+            ...
+
+    Overridden settings are kept in memory, never touching the database or
+    the cache, also when they are changed by the code under test. Values go
+    through get_db_prep_save() and to_python() like stored ones. The with
+    statement gives the backend holding them, so tests can check what the code
+    under test stored::
+
+        with override_dbsettings(ImageLimits.settings, maximum_width=800) as backend:
+            ...
+    """
+
+    def __init__(self, group, **values):
+        settings = dict(group._settings)
+        self.values = {}
+        for attribute_name, value in values.items():
+            if attribute_name not in settings:
+                raise AttributeError('%s has no setting %r.' % (group.__class__.__name__,
+                                                                attribute_name))
+            setting = settings[attribute_name]
+            self.values[setting.key] = (setting.get_db_prep_save(value), 1)
+        self._backends = []
+
+    def enable(self):
+        self._backends.append(loading.get_backend())
+        loading._backend = OverrideBackend(loading._backend, self.values)
+        return loading._backend
+
+    def disable(self):
+        loading._backend = self._backends.pop()
+
+    def __enter__(self):
+        return self.enable()
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def __call__(self, func):
+        if isinstance(func, type):
+            setup = func.setUp
+
+            def setUp(test):
+                self.enable()
+                test.addCleanup(self.disable)
+                setup(test)
+            func.setUp = setUp
+            return func
+
+        @wraps(func)
+        def inner(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        return inner
@@ -5,4 +5,5 @@ from django.contrib import admin
 urlpatterns = [
     url(r'^admin/', include(admin.site.urls)),
     url(r'^settings/', include('dbsettings.urls')),
+    url(r'^settings.json/', include('dbsettings.api_urls')),
 ]
@@ -1,14 +1,20 @@
 import datetime
+import json
+import os
+import tempfile
+import time
 
 import django
+from django.core.cache import cache
 from django.db import models
-from django import test
+from django import http, test
 from django.utils import six
 from django.utils.functional import curry
 from django.utils.translation import activate, deactivate
 
 import dbsettings
 from dbsettings import loading, views
+from dbsettings import settings as dbsettings_settings
 
 
 # Set up some settings to test
@@ -108,6 +114,41 @@ class NonReq(TestBaseModel):
     non_req = NonRequiredSettings()
 
 
+class TimedSettings(dbsettings.Group):
+    short = dbsettings.IntegerValue(cache_timeout=5)
+    inherited = dbsettings.IntegerValue()
+
+
+class Timed(TestBaseModel):
+    settings = TimedSettings(cache_timeout=None)
+
+
+class StructuredSettings(dbsettings.Group):
+    flags = dbsettings.JSONValue(default={'a': 1})
+    data = dbsettings.JSONValue(required=False)
+
+
+class Structured(TestBaseModel):
+    settings = StructuredSettings()
+
+
+def currency_choices():
+    currency_choices.calls += 1
+    return [(c, c) for c in currency_choices.currencies]
+currency_choices.calls = 0
+currency_choices.currencies = ['EUR', 'USD']
+
+
+class ChoiceSettings(dbsettings.Group):
+    currency = dbsettings.StringValue(choices=currency_choices)
+    size = dbsettings.IntegerValue(choices=[('Small', [(1, 'S'), (2, 'M')]), (3, 'L')],
+                                   required=False)
+
+
+class Chosen(TestBaseModel):
+    settings = ChoiceSettings()
+
+
 @test.override_settings(ROOT_URLCONF='dbsettings.tests.test_urls')
 class SettingsTestCase(test.TestCase):
 
@@ -124,6 +165,10 @@ class SettingsTestCase(test.TestCase):
 
     def setUp(self):
         super(SettingsTestCase, self).setUp()
+        # Cached values would otherwise outlive the rolled back test transaction.
+        cache.clear()
+        loading._local_cache.clear()
+        loading._last_seen.clear()
         # Standard test fixtures don't update the in-memory cache.
         # So we have to do it ourselves this time.
         loading.set_setting_value(MODULE_NAME, 'Populated', 'boolean', True)
@@ -294,6 +339,29 @@ class SettingsTestCase(test.TestCase):
         loading.set_setting_value(MODULE_NAME, 'NonReq', 'integer', '')
         self.assertEqual(NonReq.non_req.integer, None)
 
+    def test_json_value(self):
+        "JSON settings are parsed once per change and can't be modified in place"
+        from django.core.exceptions import ValidationError
+
+        self.assertEqual(Structured.settings.flags, {'a': 1})
+        self.assertEqual(Structured.settings.data, None)
+
+        loading.set_setting_value(MODULE_NAME, 'Structured', 'flags',
+                                  {'b': [1, 2], 'c': {'d': None}})
+        flags = Structured.settings.flags
+        self.assertEqual(flags, {'b': (1, 2), 'c': {'d': None}})
+        # The parsed structure is shared until the stored value changes
+        self.assertTrue(flags is Structured.settings.flags)
+        self.assertRaises(TypeError, flags.__setitem__, 'b', 3)
+        self.assertRaises(TypeError, flags['c'].update, {})
+
+        Structured.settings.data = '[1, "x"]'
+        self.assertEqual(Structured.settings.data, (1, 'x'))
+
+        field = dbsettings.JSONValue.field()
+        self.assertEqual(field.clean('{"a": [1]}'), {'a': (1,)})
+        self.assertRaises(ValidationError, field.clean, '{"a": ')
+
     def test_declaration(self):
         "Group declarations can only contain values and a docstring"
         # This definition is fine
@@ -308,11 +376,368 @@ class SettingsTestCase(test.TestCase):
         attrs['problem'] = 'not a Value'
         # This should fail
         self.assertRaises(TypeError, curry(type, 'BadGroup', (dbsettings.Group,), attrs))
+        # And so are settings named like methods of groups
+        for name in ('incr', 'matcher', 'lazy'):
+            self.assertRaises(ValueError, type, 'BadGroup', (dbsettings.Group,),
+                              {name: dbsettings.IntegerValue()})
 
         # Make sure affect models get the new permissions
         self.assertTrue('can_edit_populated_settings' in dict(Populated._meta.permissions))
         self.assertTrue('can_edit_unpopulated_settings' in dict(Unpopulated._meta.permissions))
 
+    def test_dump_and_load(self):
+        "Settings can be exported and imported as JSON Lines"
+        from django.core.management import call_command, CommandError
+
+        out = six.StringIO()
+        call_command('dumpsettings', 'dbsettings', stdout=out)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(records), 25)
+        self.assertTrue({
+            'module_name': MODULE_NAME, 'class_name': 'Populated', 'attribute_name': 'integer',
+            'type': 'IntegerValue', 'value': '42', 'site': 1,
+        } in records)
+
+        # Settings without stored values can be dumped with their defaults
+        out = six.StringIO()
+        call_command('dumpsettings', 'dbsettings', defaults=True, stdout=out)
+        defaults = [json.loads(line) for line in out.getvalue().splitlines()][25:]
+        self.assertEqual(len(defaults), len(loading.get_app_settings('dbsettings')) - 25)
+        self.assertTrue({
+            'module_name': MODULE_NAME, 'class_name': 'Defaults', 'attribute_name': 'string',
+            'type': 'StringValue', 'value': 'default', 'site': None, 'default': True,
+        } in defaults)
+
+        for record in records:
+            if record['class_name'] == 'Populated' and record['attribute_name'] == 'integer':
+                record['value'] = '43'
+            if record['class_name'] == 'Populated' and record['attribute_name'] == 'string':
+                record['value'] = 'Loaded'
+        records.append({'module_name': MODULE_NAME, 'class_name': 'Unpopulated',
+                        'attribute_name': 'string', 'type': 'StringValue', 'value': 'New'})
+        # which aren't stored when loaded
+        records.extend(defaults)
+        fd, path = tempfile.mkstemp(suffix='.jsonl')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join(json.dumps(record) for record in records))
+
+        out = six.StringIO()
+        call_command('loadsettings', path, dry_run=True, stdout=out)
+        self.assertEqual(Populated.settings.integer, 42)
+        self.assertEqual(Unpopulated.settings.string, '')
+        output = out.getvalue()
+        self.assertTrue('~ %s.Populated.integer (site 1): "42" -> "43"' % MODULE_NAME in output)
+        self.assertTrue('+ %s.Unpopulated.string (site 1): "New"' % MODULE_NAME in output)
+        self.assertTrue('Dry run: 1 setting(s) added, 2 changed, 23 unchanged.' in output)
+
+        sequence = loading.get_changed_settings()[0]
+        # Changed rows are updated at once: besides the savepoint, the batch
+        # takes a lookup, an update and an insert, and the sequence three more
+        with self.assertNumQueries(8):
+            call_command('loadsettings', path, stdout=six.StringIO())
+        self.assertEqual(Populated.settings.integer, 43)
+        self.assertEqual(Populated.settings.string, 'Loaded')
+        self.assertEqual(Unpopulated.settings.string, 'New')
+        # All settings changed by one load share a single change sequence number
+        new_sequence, changes = loading.get_changed_settings(sequence)
+        self.assertEqual(new_sequence, sequence + 1)
+        self.assertEqual(len(changes), 3)
+
+        # Invalid values abort the whole load
+        with open(path, 'a') as f:
+            f.write('\n' + json.dumps({'module_name': MODULE_NAME, 'class_name': 'Populated',
+                                        'attribute_name': 'integer', 'value': 'x'}))
+        loading.set_setting_value(MODULE_NAME, 'Populated', 'integer', 42)
+        self.assertRaises(CommandError, call_command, 'loadsettings', path,
+                          batch_size=5, stdout=six.StringIO())
+        self.assertEqual(Populated.settings.integer, 42)
+
+    def patch_setting(self, name, value):
+        "Changes a dbsettings configuration variable for the current test"
+        self.addCleanup(setattr, dbsettings_settings, name, getattr(dbsettings_settings, name))
+        setattr(dbsettings_settings, name, value)
+
+    def test_warm_cache(self):
+        "Warming up the cache lets all settings be read without touching the database"
+        from django.apps import apps
+        from django.core import signals
+        from django.core.management import call_command
+
+        cache.clear()
+        out = six.StringIO()
+        call_command('warm_dbsettings', stdout=out)
+        self.assertTrue(out.getvalue().startswith('Cached '))
+        with self.assertNumQueries(0):
+            self.assertEqual(Populated.settings.integer, 42)
+            self.assertEqual(Unpopulated.settings.integer, None)
+            self.assertEqual(Defaults.settings.string, 'default')
+
+        # The process-local cache is filled too, if enabled
+        self.patch_setting('LOCAL_CACHE_TIMEOUT', 60)
+        loading.warm_cache()
+        cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(module_settings.string, 'Module')
+        # Local writes are reflected immediately
+        module_settings.string = 'Changed'
+        self.assertEqual(module_settings.string, 'Changed')
+
+        # DBSETTINGS_WARM_CACHE warms up the cache with the first request, rather
+        # than when Django starts, which includes management commands like migrate
+        self.patch_setting('LOCAL_CACHE_TIMEOUT', 0)
+        self.patch_setting('WARM_CACHE', True)
+        cache.clear()
+        loading._local_cache.clear()
+        with self.assertNumQueries(0):
+            apps.get_app_config('dbsettings').ready()
+        self.addCleanup(signals.request_started.disconnect, dispatch_uid='dbsettings.warm_cache')
+        signals.request_started.send(sender=None)
+        with self.assertNumQueries(0):
+            self.assertEqual(Populated.settings.integer, 42)
+        cache.clear()
+        signals.request_started.send(sender=None)
+        with self.assertNumQueries(1):
+            self.assertEqual(Populated.settings.integer, 42)
+
+    def test_cache_groups(self):
+        "Settings can be cached in one entry per group"
+        self.patch_setting('CACHE_GROUPS', True)
+        cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(Populated.settings.integer, 42)
+        with self.assertNumQueries(0):
+            self.assertEqual(Populated.settings.boolean, True)
+            self.assertEqual(Populated.settings.string, 'Ni!')
+        entry_key = loading._group_cache_key((MODULE_NAME, 'Populated'))
+        self.assertEqual(len(cache.get(entry_key)[1]), 8)
+
+        # Changes invalidate the whole group, even for readers which loaded it before
+        stale = cache.get(entry_key)
+        loading.set_setting_value(MODULE_NAME, 'Populated', 'integer', 43)
+        cache.set(entry_key, stale)
+        with self.assertNumQueries(1):
+            self.assertEqual(Populated.settings.integer, 43)
+        with self.assertNumQueries(0):
+            self.assertEqual(Populated.settings.boolean, True)
+
+        # Bulk reads load all missing groups with a single query
+        cache.clear()
+        keys = [(MODULE_NAME, 'Populated', 'integer'), (MODULE_NAME, 'Unpopulated', 'integer')]
+        with self.assertNumQueries(1):
+            storages = loading.get_setting_storages(keys)
+        self.assertEqual([storages[key].value for key in keys], ['43', None])
+        loading.warm_cache()
+        with self.assertNumQueries(0):
+            self.assertEqual(module_settings.string, 'Module')
+
+    def test_cache_namespaces(self):
+        "Cache keys have a bounded length, and whole namespaces can be invalidated at once"
+        key = loading._get_cache_key('x' * 255, 'y' * 255, 'z' * 255)
+        self.assertEqual(len(key), len(loading._get_cache_key(MODULE_NAME, '', 'string')))
+        self.assertTrue(len(key) < 250)
+
+        self.assertEqual(Populated.settings.integer, 42)
+        with self.assertNumQueries(0):
+            loading.invalidate_all_cached_settings(app_label='other')
+            self.assertEqual(Populated.settings.integer, 42)
+        for kwargs in ({'app_label': 'dbsettings'}, {'site_id': 1}, {}):
+            loading.invalidate_all_cached_settings(**kwargs)
+            with self.assertNumQueries(2):
+                self.assertEqual(Populated.settings.integer, 42)
+                self.assertEqual(module_settings.string, 'Module')
+            with self.assertNumQueries(0):
+                self.assertEqual(Populated.settings.integer, 42)
+
+    def test_cache_timeout(self):
+        "Cache timeouts can be set per value, per group or globally"
+        from django.core.cache.backends.base import DEFAULT_TIMEOUT
+        from dbsettings.models import Setting
+
+        self.assertEqual(loading._get_cache_timeout((MODULE_NAME, 'Timed', 'short')), 5)
+        self.assertEqual(loading._get_cache_timeout((MODULE_NAME, 'Timed', 'inherited')), None)
+        self.assertTrue(loading._get_cache_timeout((MODULE_NAME, '', 'integer')) is DEFAULT_TIMEOUT)
+        self.patch_setting('CACHE_TIMEOUT', 300)
+        self.assertEqual(loading._get_cache_timeout((MODULE_NAME, '', 'integer')), 300)
+
+        # Stale entries are served while they are refreshed in the background
+        self.patch_setting('STALE_WHILE_REVALIDATE', True)
+        refreshes = []
+        self.addCleanup(setattr, loading, '_spawn', loading._spawn)
+        loading._spawn = lambda func, *args: refreshes.append(func)
+
+        Timed.settings.short = 1
+        self.assertEqual(Timed.settings.short, 1)
+        Setting.objects.filter(class_name='Timed', attribute_name='short').update(value='2')
+        self.assertEqual(Timed.settings.short, 1)
+        cache_key = loading._get_cache_key(MODULE_NAME, 'Timed', 'short')
+        tag, stale_at, storage = cache.get(cache_key)
+        cache.set(cache_key, (tag, stale_at - 10, storage), None)
+        with self.assertNumQueries(0):
+            self.assertEqual(Timed.settings.short, 1)
+            self.assertEqual(Timed.settings.short, 1)
+        # Only a single refresh is started at once
+        self.assertEqual(len(refreshes), 1)
+        refreshes[0]()
+        self.assertEqual(Timed.settings.short, 2)
+
+    def test_single_flight(self):
+        "Concurrent misses of the same key cause only a single load"
+        import threading
+        from dbsettings.models import Setting
+
+        key = (MODULE_NAME, 'Populated', 'integer')
+        loads = []
+        release = threading.Event()
+
+        def load_storage(*key, **kwargs):
+            loads.append(key)
+            release.wait(5)
+            return Setting(module_name=key[0], class_name=key[1], attribute_name=key[2],
+                           value='7')
+        self.addCleanup(setattr, loading, '_load_storage', loading._load_storage)
+        loading._load_storage = load_storage
+
+        # Threads starting late would find the value in cache already
+        flights = []
+        load_single_flight = loading._load_single_flight
+
+        def count_flights(key):
+            flights.append(key)
+            return load_single_flight(key)
+        self.addCleanup(setattr, loading, '_load_single_flight', load_single_flight)
+        loading._load_single_flight = count_flights
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            loading.get_setting_storage(*key))) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        while not loads or len(flights) < len(threads):
+            time.sleep(0.01)
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(len(results), 10)
+        self.assertTrue(all(storage is results[0] for storage in results))
+
+        # While another process refills the cache, the previous value is served
+        cache.delete(loading._get_cache_key(*key))
+        cache.add(loading._lock_key(key), True)
+        self.assertEqual(Populated.settings.integer, 7)
+        self.assertEqual(len(loads), 1)
+
+    def test_snapshot_backend(self):
+        "Settings can be served from a snapshot file, without queries or cache calls"
+        import logging
+        from django.core.exceptions import ImproperlyConfigured
+        from django.core.management import call_command
+        from dbsettings.backends import SnapshotBackend, write_snapshot
+        from dbsettings.models import Setting
+        from dbsettings.utils import lazy_setting
+
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        out = six.StringIO()
+        call_command('snapshotsettings', path, stdout=out)
+        self.assertTrue(out.getvalue().startswith('Written 25 setting(s)'))
+
+        self.addCleanup(setattr, loading, '_backend', loading._backend)
+        loading._backend = backend = SnapshotBackend(path)
+        cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(Populated.settings.integer, 42)
+            self.assertEqual(module_settings.string, 'Module')
+            self.assertEqual(Defaults.settings.string, 'default')
+        self.assertEqual(cache.get(loading._get_cache_key(MODULE_NAME, '', 'string')), None)
+        # Lazy settings don't check the settings version in the cache either
+        get_settings_version = loading.get_settings_version
+        self.addCleanup(setattr, loading, 'get_settings_version', get_settings_version)
+        loading.get_settings_version = None
+        integer = lazy_setting('dbsettings.Populated.integer')
+        self.assertEqual(integer + 1, 43)
+        self.assertRaises(NotImplementedError, loading.set_setting_value,
+                          MODULE_NAME, '', 'string', 'Changed')
+        loading.get_settings_version = get_settings_version
+        self.patch_setting('API_TOKEN', 'secret')
+        etag = self.client.get('/settings.json/', HTTP_AUTHORIZATION='Token secret')['ETag']
+
+        # The snapshot is reloaded once it changes
+        Setting.objects.filter(class_name='Populated', attribute_name='integer').update(value='43')
+        write_snapshot(path)
+        backend._checked_at = 0
+        self.assertEqual(Populated.settings.integer, 43)
+        self.assertEqual(integer + 1, 44)
+        # and so is the ETag of the JSON endpoint
+        response = self.client.get('/settings.json/', HTTP_AUTHORIZATION='Token secret',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        # A snapshot which can't be read is logged, and the previous one is served
+        messages = []
+        handler = logging.Handler()
+        handler.emit = lambda record: messages.append(record.getMessage())
+        logger = logging.getLogger('dbsettings')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        with open(path, 'w') as f:
+            f.write('{')
+        backend._checked_at = 0
+        self.assertEqual(Populated.settings.integer, 43)
+        self.assertEqual(len(messages), 1)
+        self.assertIn("Unable to read the settings snapshot", messages[0])
+        # Without a previous one, settings aren't read at all
+        loading._backend = SnapshotBackend(path)
+        self.assertRaises(ImproperlyConfigured, getattr, Populated.settings, 'integer')
+        os.remove(path)
+        self.assertRaises(ImproperlyConfigured, loading._backend.get_version)
+        write_snapshot(path)
+
+    def test_preload(self):
+        "Preloaded settings are served from memory until they are changed"
+        from dbsettings.models import Setting
+        from dbsettings.testing import override_dbsettings
+
+        self.addCleanup(setattr, loading, '_preload', None)
+        self.assertEqual(loading.preload(freeze=False), len(loading.get_all_settings()))
+        cache.delete_many([loading._get_cache_key(*key) for key in loading._settings])
+        # Preloaded values are kept decoded
+        setting = loading.get_setting(MODULE_NAME, 'Populated', 'integer')
+        self.addCleanup(vars(setting).pop, 'decode', None)
+        setting.decode = None
+        with self.assertNumQueries(0):
+            self.assertEqual(Populated.settings.integer, 42)
+            self.assertEqual(Defaults.settings.string, 'default')
+        del setting.decode
+        self.assertEqual(cache.get(loading._get_cache_key(MODULE_NAME, 'Populated', 'integer')),
+                         None)
+
+        # Changes made by this process are visible at once
+        Populated.settings.integer = 43
+        self.assertEqual(Populated.settings.integer, 43)
+
+        # Changes made by other processes are found with the next version check
+        Setting.objects.filter(class_name='Populated', attribute_name='string').update(value='Ni')
+        loading._bump_version([(MODULE_NAME, 'Populated', 'string')])
+        self.assertEqual(Populated.settings.string, 'Ni!')
+        loading._preload_checked_at = 0
+        self.assertEqual(Populated.settings.string, 'Ni')
+        with self.assertNumQueries(0):
+            self.assertEqual(Populated.settings.boolean, True)
+
+        # Other backends don't serve preloaded values
+        with override_dbsettings(Populated.settings, boolean=False):
+            self.assertEqual(Populated.settings.boolean, False)
+
+        # If the changes are unknown, preloaded values are dropped entirely
+        cache.delete(loading._changes_key(cache.incr(loading.VERSION_KEY)))
+        loading._preload_checked_at = 0
+        self.assertEqual(Populated.settings.boolean, True)
+        self.assertEqual(loading._preload, None)
+
     def assertCorrectSetting(self, value_class, *key):
         from dbsettings import loading
         setting = loading.get_setting(*key)
@@ -419,6 +844,17 @@ class SettingsTestCase(test.TestCase):
         self.assertEqual(Editable.settings.time, datetime.time(16, 37, 45))
         self.assertEqual(Editable.settings.datetime, datetime.datetime(2012, 6, 28, 16, 37, 45))
 
+        # Submitted values are compared with the ones fetched for the editor
+        # at once, instead of reading each setting again
+        reads = []
+        get_setting_storage = loading.get_setting_storage
+        self.addCleanup(setattr, loading, 'get_setting_storage', get_setting_storage)
+        loading.get_setting_storage = lambda *key: reads.append(key)
+        response = self.client.post(site_form, data)
+        self.assertRedirects(response, site_form)
+        self.assertEqual(reads, [])
+        loading.get_setting_storage = get_setting_storage
+
         # test non-req submission
         perm = Permission.objects.get(codename='can_edit_nonreq_settings')
         user.user_permissions.add(perm)
@@ -448,8 +884,729 @@ class SettingsTestCase(test.TestCase):
         user.user_permissions.remove(perm)
         self._test_form_fields(site_form, 10)
 
+    def test_compare_and_set(self):
+        "Writes can be made conditional on the version of the stored setting"
+        from dbsettings.models import ChangeSequence, Setting
+
+        # Changing a stored setting takes two queries besides taking the next
+        # change sequence number. Unchanged values don't take a number at all.
+        with self.assertNumQueries(4):
+            self.assertTrue(loading.set_setting_value(MODULE_NAME, 'Populated', 'integer', 43))
+        sequence = ChangeSequence.objects.get().value
+        with self.assertNumQueries(2):
+            self.assertFalse(loading.set_setting_value(MODULE_NAME, 'Populated', 'integer', 43))
+        self.assertEqual(ChangeSequence.objects.get().value, sequence)
+
+        version = Setting.objects.get(class_name='Populated', attribute_name='integer').version
+        self.assertRaises(loading.SettingConflict, loading.set_setting_value,
+                          MODULE_NAME, 'Populated', 'integer', 44, expected=version - 1)
+        self.assertEqual(Populated.settings.integer, 43)
+        loading.set_setting_value(MODULE_NAME, 'Populated', 'integer', 44, expected=version)
+        self.assertEqual(Populated.settings.integer, 44)
+
+        # Settings which aren't stored yet are at version 0
+        self.assertRaises(loading.SettingConflict, loading.set_setting_value,
+                          MODULE_NAME, 'Unpopulated', 'integer', 1, expected=1)
+        loading.set_setting_value(MODULE_NAME, 'Unpopulated', 'integer', 1, expected=0)
+        self.assertEqual(Unpopulated.settings.integer, 1)
+
+        # A first write racing with another one becomes a change of its value
+        self.store_concurrently(MODULE_NAME, 'Unpopulated', 'string', 'First')
+        self.assertTrue(loading.set_setting_value(MODULE_NAME, 'Unpopulated', 'string', 'Second'))
+        storage = Setting.objects.get(class_name='Unpopulated', attribute_name='string')
+        self.assertEqual((storage.value, storage.version), ('Second', 2))
+        self.store_concurrently(MODULE_NAME, 'Unpopulated', 'boolean', 'True')
+        self.assertRaises(loading.SettingConflict, loading.set_setting_value,
+                          MODULE_NAME, 'Unpopulated', 'boolean', False, expected=0)
+
+    def store_concurrently(self, module_name, class_name, attribute_name, value):
+        """
+        Makes the next write of a change sequence number first store the
+        setting, as if another process stored it at the same time
+        """
+        from dbsettings.models import Setting
+
+        next_sequence = loading._next_sequence
+
+        def racing_next_sequence(using):
+            loading._next_sequence = next_sequence
+            Setting(module_name=module_name, class_name=class_name,
+                    attribute_name=attribute_name, value=value, version=1).save(using=using)
+            return next_sequence(using)
+        self.addCleanup(setattr, loading, '_next_sequence', next_sequence)
+        loading._next_sequence = racing_next_sequence
+
+    def test_increment(self):
+        "Numeric settings can be incremented and decremented atomically"
+        from decimal import Decimal
+
+        self.assertEqual(Populated.settings.incr('integer'), 43)
+        self.assertEqual(Populated.settings.incr('integer', 10), 53)
+        self.assertEqual(Populated.settings.decr('integer', 3), 50)
+        self.assertEqual(Populated.settings.integer, 50)
+
+        # Settings which aren't stored yet start from their default, or zero
+        self.assertEqual(loading.decrement_setting_value(MODULE_NAME, 'Defaults', 'integer'), 0)
+        self.assertEqual(Defaults.settings.integer, 0)
+        self.assertEqual(NonReq.non_req.incr('integer', 2), 2)
+
+        # An increment which didn't find the setting stored, since another one
+        # stored it meanwhile, adds to its value
+        Unpopulated.settings.integer = 5
+        pick_storages = loading._pick_storages
+        self.addCleanup(setattr, loading, '_pick_storages', pick_storages)
+        loading._pick_storages = lambda storages: setattr(
+            loading, '_pick_storages', pick_storages) or {}
+        self.assertEqual(Unpopulated.settings.incr('integer'), 6)
+        self.assertEqual(Unpopulated.settings.integer, 6)
+        self.assertEqual(NonReq.non_req.incr('decimal', Decimal('0.25')), Decimal('0.25'))
+        self.assertEqual(NonReq.non_req.incr('decimal', Decimal('1.5')), Decimal('1.75'))
+        self.assertEqual(NonReq.non_req.decimal, Decimal('1.75'))
+
+        self.assertRaises(TypeError, Populated.settings.incr, 'string')
+
+    def test_concurrent_edits(self):
+        "The editor reports settings changed by someone else instead of overwriting them"
+        from django.contrib.auth.models import User, Permission
+
+        user = User.objects.create_user('dbsettings', '', 'dbsettings')
+        user.is_staff = True
+        user.save()
+        user.user_permissions.add(Permission.objects.get(codename='can_edit_editable_settings'))
+        self.client.login(username='dbsettings', password='dbsettings')
+        site_form = '/settings/'
+
+        response = self.client.get(site_form)
+        data = {
+            '%s__Editable__integer' % MODULE_NAME: '4',
+            '%s__Editable__string' % MODULE_NAME: 'Mine',
+            '%s__Editable__list_semi_colon' % MODULE_NAME: 'a@b.com',
+            '%s__Editable__list_comma' % MODULE_NAME: 'a@b.com',
+            '%s__Editable__date' % MODULE_NAME: '2012-06-28',
+            '%s__Editable__time' % MODULE_NAME: '16:37:45',
+            '%s__Editable__datetime' % MODULE_NAME: '2012-06-28 16:37:45',
+            'dbsettings_versions': response.context['form'].versions_json(),
+        }
+        # Meanwhile, someone else changes one of the settings
+        loading.set_setting_value(MODULE_NAME, 'Editable', 'integer', 5)
+
+        response = self.client.post(site_form, data)
+        self.assertFormError(response, 'form', '%s__Editable__integer' % MODULE_NAME,
+                             'This setting was changed by someone else in the meantime. '
+                             'Save again to overwrite it.')
+        self.assertEqual(Editable.settings.integer, 5)
+        self.assertEqual(Editable.settings.string, 'Mine')
+
+        # Saving again, knowing about the change, overwrites it
+        data['dbsettings_versions'] = response.context['form'].versions_json()
+        response = self.client.post(site_form, data)
+        self.assertRedirects(response, site_form)
+        self.assertEqual(Editable.settings.integer, 4)
+
+    def test_editor_pages(self):
+        "The editor can be searched and shows large registries a page at a time"
+        from django.contrib.auth.models import User, Permission
+
+        user = User.objects.create_user('dbsettings', '', 'dbsettings')
+        user.is_staff = True
+        user.save()
+        user.user_permissions.add(Permission.objects.get(codename='can_edit_editable_settings'))
+        self.client.login(username='dbsettings', password='dbsettings')
+        site_form = '/settings/'
+
+        response = self.client.get(site_form, {'q': 'editable semi'})
+        self.assertEqual(list(response.context['form'].fields),
+                         ['%s__Editable__list_semi_colon' % MODULE_NAME])
+        response = self.client.get(site_form, {'q': 'nothing matches this'})
+        self.assertContains(response, 'No settings found.')
+
+        self.patch_setting('EDITOR_PAGE_SIZE', 3)
+        response = self.client.get(site_form, {'group': 'Editable', 'page': '2'})
+        self.assertEqual(len(response.context['form'].fields), 3)
+        self.assertContains(response, 'Page 2 of 3')
+        response = self.client.get(site_form, {'group': 'Editable', 'page': '9'})
+        self.assertEqual(response.context['page'].number, 3)
+
+        # Values of the whole page are fetched at once
+        cache.clear()
+        loading._local_cache.clear()
+        self.client.get(site_form, {'group': 'Editable'})
+        with self.assertNumQueries(1):
+            storages = loading.get_setting_storages(
+                (MODULE_NAME, 'Editable', name) for name in ('integer', 'string', 'date'))
+        self.assertEqual(len(storages), 3)
+
+    def test_json_api(self):
+        "Settings can be polled as JSON, with ETags to avoid sending unchanged settings"
+        from django.contrib.auth.models import User
+
+        url = '/settings.json/dbsettings/'
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.patch_setting('API_TOKEN', 'secret')
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Token wrong').status_code, 403)
+
+        response = self.client.get(url, {'fields': 'dbsettings.Populated,dbsettings.clash1'},
+                                   HTTP_AUTHORIZATION='Token secret')
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['version'], loading.get_settings_version())
+        self.assertEqual(data['settings']['dbsettings.Populated.integer'], 42)
+        self.assertEqual(data['settings']['dbsettings.Populated.date'], '2012-06-28')
+        self.assertEqual(data['settings']['dbsettings.clash1'], False)
+        self.assertEqual(len(data['settings']), 9)
+
+        # Unchanged settings aren't sent again
+        etag = response['ETag']
+        response = self.client.get(url, {'fields': 'dbsettings.Populated,dbsettings.clash1'},
+                                   HTTP_AUTHORIZATION='Token secret', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        loading.set_setting_value(MODULE_NAME, 'Populated', 'integer', 43)
+        response = self.client.get(url, {'fields': 'dbsettings.Populated,dbsettings.clash1'},
+                                   HTTP_AUTHORIZATION='Token secret', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+
+        # ETags differ between sites
+        with self.settings(SITE_ID=2):
+            response = self.client.get(url, {'fields': 'dbsettings.Populated,dbsettings.clash1'},
+                                       HTTP_AUTHORIZATION='Token secret', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        # Without the cache, ETags follow the change sequence
+        self.patch_setting('USE_CACHE', False)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Token secret')
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_AUTHORIZATION='Token secret',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        loading.set_setting_value(MODULE_NAME, 'Populated', 'integer', 44)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Token secret',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.patch_setting('USE_CACHE', True)
+
+        # Staff members can read settings without the token
+        User.objects.create_superuser('dbsettings', '', 'dbsettings')
+        self.client.login(username='dbsettings', password='dbsettings')
+        response = self.client.get('/settings.json/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_change_feed(self):
+        "Settings changed since a sequence number can be fetched incrementally"
+        from dbsettings.models import Setting
+
+        sequence, changes = loading.get_changed_settings()
+        self.assertEqual(changes[MODULE_NAME, 'Populated', 'integer'], 42)
+        self.assertEqual(changes[MODULE_NAME, 'Unpopulated', 'string'], '')
+        self.assertEqual(len(changes), len(loading.get_all_settings()))
+        self.assertEqual(loading.get_changed_settings(sequence), (sequence, {}))
+
+        loading.set_setting_value(MODULE_NAME, 'Populated', 'integer', 43)
+        Populated.settings.incr('integer')
+        loading.set_setting_value(MODULE_NAME, 'Unpopulated', 'string', 'new')
+        new_sequence, changes = loading.get_changed_settings(sequence)
+        self.assertEqual(changes, {
+            (MODULE_NAME, 'Populated', 'integer'): 44,
+            (MODULE_NAME, 'Unpopulated', 'string'): 'new',
+        })
+        self.assertEqual(new_sequence, sequence + 3)
+
+        self.patch_setting('API_TOKEN', 'secret')
+        response = self.client.get('/settings.json/changes/', {'since': sequence + 1},
+                                   HTTP_AUTHORIZATION='Token secret')
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data, {'sequence': new_sequence, 'settings': {
+            'dbsettings.Populated.integer': 44, 'dbsettings.Unpopulated.string': 'new'}})
+
+        # Without changes, a long-polling request waits for them until it times out
+        self.addCleanup(setattr, views, 'CHANGES_POLL_INTERVAL', views.CHANGES_POLL_INTERVAL)
+        views.CHANGES_POLL_INTERVAL = 0.01
+        start = time.time()
+        response = self.client.get('/settings.json/changes/',
+                                   {'since': new_sequence, 'wait': '0.05'},
+                                   HTTP_AUTHORIZATION='Token secret')
+        self.assertGreaterEqual(time.time() - start, 0.05)
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data, {'sequence': new_sequence, 'settings': {}})
+        response = self.client.get('/settings.json/changes/', {'since': 'x'},
+                                   HTTP_AUTHORIZATION='Token secret')
+        self.assertEqual(response.status_code, 400)
+
+        # Without since, all settings are returned with the current sequence
+        response = self.client.get('/settings.json/changes/',
+                                   HTTP_AUTHORIZATION='Token secret')
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['sequence'], new_sequence)
+        self.assertEqual(len(data['settings']), len(loading.get_all_settings()))
+
+        # Rows saved directly still get a sequence number
+        Setting.objects.filter(attribute_name='string', class_name='Unpopulated').delete()
+        Setting(module_name=MODULE_NAME, class_name='Unpopulated', attribute_name='string',
+                value='saved').save()
+        self.assertEqual(loading.get_changed_settings(new_sequence)[1],
+                         {(MODULE_NAME, 'Unpopulated', 'string'): 'saved'})
+
+    def test_profiling(self):
+        "Reads and writes of settings can be profiled"
+        import logging
+        from dbsettings.middleware import SettingsProfileMiddleware
+        from dbsettings.profiling import SettingsProfile
+
+        with SettingsProfile() as profile:
+            Populated.settings.integer
+            Populated.settings.integer
+            Unpopulated.settings.integer
+            Populated.settings.string = 'Changed'
+        Populated.settings.integer
+        self.assertEqual(loading._profiling, 0)
+        self.assertEqual((profile.reads, profile.writes), (3, 1))
+        self.assertEqual([call[:3] for call in profile.calls], [
+            ('get', (MODULE_NAME, 'Populated', 'integer'), 'database'),
+            ('get', (MODULE_NAME, 'Populated', 'integer'), 'cache'),
+            ('get', (MODULE_NAME, 'Unpopulated', 'integer'), 'default'),
+            ('set', (MODULE_NAME, 'Populated', 'string'), None),
+        ])
+        self.assertEqual(profile.summary()[0][:2], ((MODULE_NAME, 'Populated', 'integer'), 2))
+
+        # Requests reading too many settings are logged
+        messages = []
+        handler = logging.Handler()
+        handler.emit = lambda record: messages.append(record.getMessage())
+        logger = logging.getLogger('dbsettings')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        self.patch_setting('PROFILE_MAX_READS', 2)
+        middleware = SettingsProfileMiddleware()
+        for reads in (2, 3):
+            request = test.RequestFactory().get('/reads/')
+            middleware.process_request(request)
+            for i in range(reads):
+                Populated.settings.integer
+            middleware.process_response(request, http.HttpResponse())
+        self.assertEqual(len(messages), 1)
+        self.assertIn('GET /reads/ read settings 3 times', messages[0])
+        self.assertIn('%s.Populated.integer (3)' % MODULE_NAME, messages[0])
+
+    def test_override(self):
+        "Settings can be overridden in memory for tests"
+        from dbsettings.backends import MemoryBackend
+        from dbsettings.testing import override_dbsettings
+
+        overrides = override_dbsettings(Populated.settings, integer=7,
+                                        date=datetime.date(2001, 2, 3))
+        with overrides as backend:
+            with self.assertNumQueries(0):
+                self.assertEqual(Populated.settings.integer, 7)
+                self.assertEqual(Populated.settings.date, datetime.date(2001, 2, 3))
+                Populated.settings.integer = 8
+                self.assertEqual(Populated.settings.incr('integer'), 9)
+            self.assertIs(backend, loading.get_backend())
+            self.assertEqual(backend.get_storage((MODULE_NAME, 'Populated', 'integer')).value,
+                             '9')
+            self.assertEqual(Populated.settings.string, 'Ni!')
+        self.assertEqual(Populated.settings.integer, 42)
+
+        @override_dbsettings(Populated.settings, list_comma='x, y')
+        def read():
+            return Populated.settings.list_comma
+        self.assertEqual(read(), ['x', 'y'])
+        self.assertRaises(AttributeError, override_dbsettings, Populated.settings, missing=1)
+
+        # The whole test suite may keep settings in memory
+        self.addCleanup(setattr, loading, '_backend', loading.get_backend())
+        loading._backend = MemoryBackend()
+        with self.assertNumQueries(0):
+            self.assertEqual(Populated.settings.integer, None)
+            self.assertTrue(loading.set_setting_value(MODULE_NAME, 'Populated', 'integer', 5))
+            self.assertFalse(loading.set_setting_value(MODULE_NAME, 'Populated', 'integer', 5))
+            self.assertEqual(Populated.settings.integer, 5)
+            self.assertRaises(loading.SettingConflict, loading.set_setting_value,
+                              MODULE_NAME, 'Populated', 'integer', 6, expected=0)
+            self.assertEqual(Populated.settings.decr('integer'), 4)
+        loading.get_backend().reset()
+        self.assertEqual(Populated.settings.integer, None)
+
+    def test_invalid_values(self):
+        "Invalid values are rejected on write, and stored ones are read as the default"
+        from dbsettings import values
+        from dbsettings.models import Setting
+
+        self.assertRaises(ValueError, loading.set_setting_value,
+                          MODULE_NAME, 'Defaults', 'integer', 'many')
+        self.assertEqual(Defaults.settings.integer, 1)
+        Defaults.settings.integer = None
+        self.assertEqual(Defaults.settings.integer, None)
+        # Dates and times which match none of the input formats are rejected too
+        for name, value in (('date', '28/06/2012 old locale'), ('time', 'noon'),
+                            ('datetime', '2012-06-28T16:37')):
+            with self.assertRaises(ValueError):
+                loading.set_setting_value(MODULE_NAME, 'Editable', name, value)
+        loading.set_setting_value(MODULE_NAME, 'Editable', 'date', '2012-06-28')
+        self.assertEqual(Editable.settings.date, datetime.date(2012, 6, 28))
+
+        warnings = []
+        self.addCleanup(setattr, values, 'logger', values.logger)
+        values.logger = type('Logger', (object,), {
+            'warning': lambda self, *args, **kwargs: warnings.append(args)})()
+        Setting.objects.filter(class_name='Defaults', attribute_name='integer').update(value='x')
+        loading.invalidate_cached_settings([(MODULE_NAME, 'Defaults', 'integer')])
+        self.assertEqual(Defaults.settings.integer, 1)
+        self.assertEqual(Defaults.settings.integer, 1)
+        self.assertEqual(len(warnings), 1)
+
+    def test_choices(self):
+        "Callable choices are evaluated lazily and again after settings changed"
+        from dbsettings import forms
+
+        self.addCleanup(setattr, currency_choices, 'currencies', ['EUR', 'USD'])
+        setting = loading.get_setting(MODULE_NAME, 'Chosen', 'currency')
+        setting.invalidate_choices()
+        calls = currency_choices.calls
+        user = type('User', (), {'has_perm': lambda self, perm: True})()
+        for i in range(2):
+            editor = forms.customized_editor(user, [setting])
+            self.assertEqual(editor.base_fields['%s__Chosen__currency' % MODULE_NAME].choices,
+                             [('EUR', 'EUR'), ('USD', 'USD')])
+        self.assertEqual(currency_choices.calls, calls + 1)
+
+        # Only choices can be stored
+        currency_choices.currencies.append('GBP')
+        self.assertRaises(ValueError, Chosen.settings.__setattr__, 'currency', 'GBP')
+        setting.invalidate_choices()
+        Chosen.settings.currency = 'GBP'
+        self.assertEqual(currency_choices.calls, calls + 2)
+        self.assertEqual(Chosen.settings.currency, 'GBP')
+        # Which was a change of settings, so choices are evaluated again
+        self.assertEqual(setting.choices[-1], ('GBP', 'GBP'))
+        self.assertEqual(currency_choices.calls, calls + 3)
+
+        # Without the cache, there's no settings version to keep them by
+        self.patch_setting('USE_CACHE', False)
+        for i in range(2):
+            self.assertEqual(setting.choices[-1], ('GBP', 'GBP'))
+        self.assertEqual(currency_choices.calls, calls + 5)
+
+        Chosen.settings.size = 2
+        Chosen.settings.size = None
+        self.assertRaises(ValueError, Chosen.settings.__setattr__, 'size', 4)
+
+    def test_matcher(self):
+        "Lists can be matched against with exact entries and wildcards"
+        Populated.settings.list_semi_colon = 'a@b.com; *@blah.com;user?@c.org'
+        matcher = Populated.settings.matcher('list_semi_colon')
+        self.assertEqual(matcher.exact, frozenset(['a@b.com']))
+        self.assertIn('a@b.com', matcher)
+        self.assertIn('anyone@blah.com', matcher)
+        self.assertIn('user1@c.org', matcher)
+        self.assertNotIn('user12@c.org', matcher)
+        self.assertNotIn('a@b.comx', matcher)
+        self.assertNotIn('x@blah.com.evil', matcher)
+        self.assertNotIn('A@B.com', matcher)
+        self.assertIn('A@B.com', Populated.settings.matcher('list_semi_colon', ignore_case=True))
+        self.assertIs(Populated.settings.matcher('list_semi_colon'), matcher)
+
+        Populated.settings.list_semi_colon = 'x.y@z.com'
+        matcher = Populated.settings.matcher('list_semi_colon')
+        self.assertIsNone(matcher.pattern)
+        self.assertTrue(matcher.match('x.y@z.com'))
+        self.assertFalse(matcher.match('xay@z.com'))
+
+    def test_setting_changed(self):
+        "Changes are signalled after commit, and derived values follow them"
+        from django.core.management import call_command
+        from django.db import connection
+        from dbsettings.signals import setting_changed
+        from dbsettings.utils import derived_setting
+
+        received = []
+
+        def receiver(sender, keys, **kwargs):
+            received.append(sorted(keys))
+
+        def commit():
+            # Tests run in a transaction which is never committed
+            callbacks, connection.run_on_commit = connection.run_on_commit, []
+            for sids, func in callbacks:
+                func()
+        commit()
+        setting_changed.connect(receiver)
+        self.addCleanup(setting_changed.disconnect, receiver)
+
+        Populated.settings.integer = 43
+        self.assertEqual(received, [])
+        commit()
+        self.assertEqual(received, [[(MODULE_NAME, 'Populated', 'integer')]])
+
+        # Bulk writes are signalled at once
+        del received[:]
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+            for name in ('integer', 'string'):
+                f.write(json.dumps({'module_name': MODULE_NAME, 'class_name': 'Unpopulated',
+                                    'attribute_name': name, 'value': '1'}) + '\n')
+        self.addCleanup(os.remove, f.name)
+        call_command('loadsettings', f.name, verbosity=0)
+        commit()
+        self.assertEqual(received, [[(MODULE_NAME, 'Unpopulated', 'integer'),
+                                     (MODULE_NAME, 'Unpopulated', 'string')]])
+
+        calls = []
+
+        @derived_setting((MODULE_NAME, 'Populated', 'integer'), (MODULE_NAME, '', 'integer'))
+        def total(a, b):
+            calls.append((a, b))
+            return a + b
+        self.assertEqual(total(), 43 + 14)
+        self.assertEqual(total(), 43 + 14)
+        self.assertEqual(len(calls), 1)
+        Populated.settings.integer = 1
+        self.assertEqual(total(), 1 + 14)
+        self.assertEqual(calls, [(43, 14), (1, 14)])
+
+    def test_lazy_setting(self):
+        "Lazy settings are read on first use, and again once settings changed"
+        from dbsettings.models import Setting
+        from dbsettings.testing import override_dbsettings
+        from dbsettings.utils import lazy_setting
+
+        with self.assertNumQueries(0):
+            integer = lazy_setting((MODULE_NAME, 'Populated', 'integer'))
+            boolean = lazy_setting('dbsettings.Populated.boolean')
+            string = Populated.settings.lazy('string')
+            missing = lazy_setting('dbsettings.Populated.missing')
+        self.assertEqual(integer + 1, 43)
+        self.assertEqual(2 * integer, 84)
+        self.assertTrue(integer > 41)
+        self.assertTrue(boolean)
+        self.assertEqual(string.lower(), 'ni!')
+        self.assertEqual(six.text_type(string), 'Ni!')
+        self.assertEqual(integer(), 42)
+        with self.assertRaises(KeyError):
+            missing + 1
+
+        # Values are kept until the settings version changes, which is only
+        # checked once every PRELOAD_CHECK_INTERVAL seconds
+        versions = []
+        get_settings_version = loading.get_settings_version
+        self.addCleanup(setattr, loading, 'get_settings_version', get_settings_version)
+        loading.get_settings_version = lambda: versions.append(1) or get_settings_version()
+        loading._recent_version_at = 0
+        Setting.objects.filter(class_name='Populated', attribute_name='integer').update(value='1')
+        for i in range(3):
+            self.assertEqual(integer, 42)
+        self.assertEqual(len(versions), 1)
+        # Changes made by this process are seen at once
+        loading.invalidate_cached_settings([(MODULE_NAME, 'Populated', 'integer')])
+        self.assertEqual(integer, 1)
+        self.assertEqual(len(versions), 1)
+        # Others are seen with the next check
+        Setting.objects.filter(class_name='Populated', attribute_name='integer').update(value='3')
+        cache.clear()
+        loading._local_cache.clear()
+        self.assertEqual(integer, 1)
+        loading._recent_version_at = 0
+        self.assertEqual(integer, 3)
+        Populated.settings.integer = 2
+        self.assertEqual(integer, 2)
+
+        with override_dbsettings(Populated.settings, integer=7):
+            self.assertEqual(integer, 7)
+            Populated.settings.integer = 8
+            self.assertEqual(integer, 8)
+        self.assertEqual(integer, 2)
+
+        # Without the cache, there's no version, so values are read on every use
+        self.patch_setting('USE_CACHE', False)
+        Setting.objects.filter(class_name='Populated', attribute_name='integer').update(value='4')
+        self.assertEqual(integer, 4)
+
+    def test_global_settings(self):
+        "Global settings apply to all sites which don't override them"
+        from django.contrib.sites.models import Site
+        from dbsettings.models import Setting
+
+        other = Site.objects.create(domain='other.example.com', name='other')
+        Setting.all_sites.bulk_create([Setting(
+            module_name=MODULE_NAME, class_name='Populated', attribute_name='integer',
+            value='2', site=other)])
+
+        self.assertTrue(loading.set_global_setting_value(MODULE_NAME, 'Unpopulated', 'integer', 7))
+        self.assertTrue(loading.set_global_setting_value(MODULE_NAME, 'Populated', 'integer', 5))
+        self.assertEqual(Unpopulated.settings.integer, 7)
+        self.assertEqual(Populated.settings.integer, 42)
+        cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(Populated.settings.integer, 42)
+        with self.settings(SITE_ID=other.pk):
+            self.assertEqual(Populated.settings.integer, 2)
+            self.assertEqual(Unpopulated.settings.integer, 7)
+            sequence, changes = loading.get_changed_settings()
+            self.assertEqual(changes[MODULE_NAME, 'Populated', 'integer'], 2)
+
+        # Changes of the current site override the global value
+        self.assertEqual(Unpopulated.settings.incr('integer'), 8)
+        self.assertEqual(Setting.all_sites.get(class_name='Unpopulated', site=None).value, '7')
+
+        # The global value can be applied to all sites at once, which shows
+        # up in the change feed even though the global value didn't change
+        sequence = loading.get_changed_settings()[0]
+        self.assertTrue(loading.set_global_setting_value(
+            MODULE_NAME, 'Populated', 'integer', 5, clear_overrides=True))
+        with self.settings(SITE_ID=other.pk):
+            changes = loading.get_changed_settings(sequence)[1]
+            self.assertEqual(changes, {(MODULE_NAME, 'Populated', 'integer'): 5})
+        self.assertEqual(Populated.settings.integer, 5)
+        with self.settings(SITE_ID=other.pk):
+            self.assertEqual(Populated.settings.integer, 5)
+        self.assertFalse(loading.set_global_setting_value(MODULE_NAME, 'Populated', 'integer', 5))
+        self.assertTrue(loading.set_global_setting_value(
+            MODULE_NAME, 'Populated', 'string', 'Global', clear_overrides=True))
+        self.assertEqual(Populated.settings.string, 'Global')
+
+    def test_template_tags(self):
+        "Settings used by a template are fetched at once"
+        from django.template import Context, Template, TemplateSyntaxError
+        from django.test.client import RequestFactory
+        from dbsettings.context_processors import dbsettings as dbsettings_processor
+
+        loading.set_setting_value(MODULE_NAME, 'Populated', 'string', '<b>')
+        template = Template(
+            '{% load dbsettings_tags %}'
+            '{% dbsetting "dbsettings.Populated.string" %} '
+            '{% dbsettings_group "dbsettings.Populated" as populated %}{{ populated.integer }} '
+            '{% dbsetting "dbsettings.clash1" as clash %}{{ clash }}')
+        cache.clear()
+        loading._local_cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(template.render(Context()), '&lt;b&gt; 42 False')
+
+        # Groups include settings registered after the template was rendered
+        setting = loading.get_setting(MODULE_NAME, 'Unpopulated', 'boolean')
+        self.addCleanup(loading.register_setting, setting)
+        template = Template('{% load dbsettings_tags %}'
+                            '{% dbsettings_group "dbsettings.Unpopulated" as u %}{{ u|length }}')
+        loading.unregister_setting(setting)
+        self.assertEqual(template.render(Context()), '7')
+        loading.register_setting(setting)
+        self.assertEqual(template.render(Context()), '8')
+
+        # Settings of parent and included templates are fetched per template
+        base = Template('{% load dbsettings_tags %}'
+                        '{% dbsetting "dbsettings.Populated.integer" %} '
+                        '{% block content %}{% endblock %} '
+                        '{% dbsetting "dbsettings.Populated.date" %}')
+        included = Template('{% load dbsettings_tags %}'
+                            '{% dbsetting "dbsettings.Populated.boolean" %} '
+                            '{% dbsettings_group "dbsettings.Unpopulated" as u %}{{ u.integer }}')
+        template = Template('{% extends base %}{% load dbsettings_tags %}{% block content %}'
+                            '{% dbsetting "dbsettings.Populated.string" %} {% include included %}'
+                            '{% endblock %}')
+        cache.clear()
+        loading._local_cache.clear()
+        with self.assertNumQueries(3):
+            self.assertEqual(template.render(Context({'base': base, 'included': included})),
+                             '42 &lt;b&gt; True None 2012-06-28')
+
+        with self.assertRaises(TemplateSyntaxError):
+            Template('{% load dbsettings_tags %}{% dbsetting "dbsettings.Populated" %}').render(
+                Context())
+        with self.assertRaises(TemplateSyntaxError):
+            Template('{% load dbsettings_tags %}{% dbsetting dbsettings.Populated.string %}')
+
+        # The context processor fetches all settings of an app on first use
+        context = dbsettings_processor(RequestFactory().get('/'))
+        template = Template('{{ dbsettings.dbsettings.Populated.integer }} '
+                            '{{ dbsettings.dbsettings.Populated.boolean }} '
+                            '{{ dbsettings.dbsettings.missing|default:"-" }}')
+        cache.clear()
+        loading._local_cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(template.render(Context(context)), '42 True -')
+
+        # Each app is fetched once per request, even from the cache
+        fetches = []
+        get_setting_storages = loading.get_setting_storages
+
+        def fetch(keys):
+            fetches.append(keys)
+            return get_setting_storages(keys)
+        self.addCleanup(setattr, loading, 'get_setting_storages', get_setting_storages)
+        loading.get_setting_storages = fetch
+        context = dbsettings_processor(RequestFactory().get('/'))
+        self.assertEqual(template.render(Context(context)), '42 True -')
+        self.assertEqual(len(fetches), 1)
+
     def _test_form_fields(self, url, fields_num, present=True, variable_name='form'):
         global_setting = '%s____clash2' % MODULE_NAME  # Some global setting name
         response = self.client.get(url)
         self.assertEqual(present, global_setting in response.context[0][variable_name].fields)
         self.assertEqual(len(response.context[0][variable_name].fields), fields_num)
+
+
+class ReplicaTestCase(test.TestCase):
+    multi_db = True
+
+    def setUp(self):
+        super(ReplicaTestCase, self).setUp()
+        cache.clear()
+        loading._local_cache.clear()
+        loading._last_seen.clear()
+        self.addCleanup(setattr, dbsettings_settings, 'READ_DATABASE',
+                        dbsettings_settings.READ_DATABASE)
+        dbsettings_settings.READ_DATABASE = 'replica'
+        self.addCleanup(setattr, loading, '_pinned_until', 0)
+
+    def reload(self):
+        cache.clear()
+        return Populated.settings.integer
+
+    def test_read_your_writes(self):
+        "Reads go to the replica, except shortly after settings were written"
+        from django.test.client import RequestFactory
+        from dbsettings.middleware import ReadYourWritesMiddleware
+        from dbsettings.models import Setting
+
+        # The replica lags behind the primary
+        Setting(module_name=MODULE_NAME, class_name='Populated', attribute_name='integer',
+                value='1').save(using='replica')
+        self.assertEqual(self.reload(), 1)
+
+        loading.set_setting_value(MODULE_NAME, 'Populated', 'integer', 2)
+        self.assertEqual(Setting.objects.using('default').get(attribute_name='integer').value, '2')
+        self.assertEqual(Setting.objects.using('replica').get(attribute_name='integer').value, '1')
+        self.assertEqual(self.reload(), 2)
+        loading._pinned_until = 0
+        self.assertEqual(self.reload(), 1)
+
+        # Requests which changed settings pin their session to the primary
+        middleware = ReadYourWritesMiddleware()
+        request = RequestFactory().get('/')
+        middleware.process_request(request)
+        loading.set_setting_value(MODULE_NAME, 'Populated', 'integer', 3)
+        response = middleware.process_response(request, http.HttpResponse())
+        loading._pinned_until = 0
+        self.assertEqual(self.reload(), 1)
+
+        request = RequestFactory().get('/')
+        request.COOKIES[middleware.cookie_name] = response.cookies[middleware.cookie_name].value
+        middleware.process_request(request)
+        self.assertEqual(self.reload(), 3)
+        middleware.process_response(request, http.HttpResponse())
+        self.assertEqual(self.reload(), 1)
+
+    def test_shared_cache_refill(self):
+        "Processes which aren't pinned don't cache old values of the replica after writes"
+        from dbsettings.models import Setting
+
+        Setting(module_name=MODULE_NAME, class_name='Populated', attribute_name='integer',
+                value='1').save(using='replica')
+        self.assertEqual(self.reload(), 1)
+        loading.set_setting_value(MODULE_NAME, 'Populated', 'integer', 2)
+
+        # Another process refills the cache before the writer reads it again
+        pinned_until, loading._pinned_until = loading._pinned_until, 0
+        loading._local_cache.clear()
+        loading._last_seen.clear()
+        self.assertEqual(Populated.settings.integer, 2)
+        loading._pinned_until = pinned_until
+        with self.assertNumQueries(0, using='default'):
+            self.assertEqual(Populated.settings.integer, 2)
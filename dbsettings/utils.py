@@ -1,3 +1,11 @@
+import operator
+from functools import wraps
+
+from django.utils import six
+
+from dbsettings.signals import setting_changed
+
+
 def set_defaults(app, *defaults):
     "Installs a set of default values during syncdb processing"
     from django.core.exceptions import ImproperlyConfigured
@@ -23,3 +31,185 @@ def set_defaults(app, *defaults):
                     raise ImproperlyConfigured("%s requires dbsettings." % app_label)
 
     signals.post_migrate.connect(install_settings, sender=app, weak=False)
+
+
+class FrozenDict(dict):
+    "Read-only dict, used for structured values shared between all readers"
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("'%s' object does not support item assignment" %
+                        self.__class__.__name__)
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __hash__(self):
+        return hash(frozenset(self.items()))
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def freeze(value):
+    "Recursively converts dicts to FrozenDicts and lists to tuples"
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def derived_setting(*keys):
+    """
+    Decorator memoizing a function of the values of the settings with the
+    given (module_name, class_name, attribute_name) keys, which are passed to
+    it as arguments. It's called again only once one of the settings changed::
+
+        @derived_setting(('myapp.models', 'Mail', 'blocked'))
+        def blocked_pattern(blocked):
+            return re.compile('|'.join(blocked))
+
+        blocked_pattern().match(sender)
+    """
+    def decorator(func):
+        from dbsettings.loading import get_setting, get_setting_storages
+        memo = [None]
+
+        @wraps(func)
+        def inner():
+            storages = get_setting_storages(keys)
+            raw = tuple(storages[key].value for key in keys)
+            cached = memo[0]
+            if cached is None or cached[0] != raw:
+                values = [get_setting(*key).decode(value) for key, value in zip(keys, raw)]
+                cached = memo[0] = (raw, func(*values))
+            return cached[1]
+
+        def invalidate():
+            "Makes the function be called again on next use"
+            memo[0] = None
+        inner.invalidate = invalidate
+        return inner
+    return decorator
+
+
+# Number of changes of settings signalled in this process. Changes made by
+# other processes are noticed through the settings version instead.
+_changes = 0
+
+
+def _count_change(sender, **kwargs):
+    global _changes
+    _changes += 1
+setting_changed.connect(_count_change)
+
+
+def _proxy(func):
+    def inner(self, *args):
+        return func(self(), *args)
+    return inner
+
+
+def _reverse(func):
+    return lambda a, b: func(b, a)
+
+
+class LazySetting(object):
+    """
+    Proxy for the value of a setting, see lazy_setting. Calling it returns the
+    plain value, e.g. for isinstance() checks or serialization.
+    """
+
+    def __init__(self, setting):
+        # A Value, a (module_name, class_name, attribute_name) key or a name
+        self._setting = setting
+        self._memo = None
+
+    def _get_setting(self):
+        from dbsettings.loading import get_setting, get_setting_by_name
+        setting = self._setting
+        if isinstance(setting, six.string_types):
+            setting = self._setting = get_setting_by_name(setting)
+        elif isinstance(setting, tuple):
+            setting = self._setting = get_setting(*setting)
+        return setting
+
+    def __call__(self):
+        from dbsettings.loading import get_backend
+        backend = get_backend()
+        tag = (backend.get_version(), backend, _changes)
+        memo = self._memo
+        # Without a version, changes made elsewhere can't be noticed, so the
+        # value is read every time
+        if memo is None or tag[0] is None or memo[0] != tag:
+            # Any instance will do, values are the same for all of them
+            memo = self._memo = (tag, self._get_setting().__get__(self))
+        return memo[1]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self(), name)
+
+    def __repr__(self):
+        return '<LazySetting: %r>' % (self(),)
+
+    __str__ = _proxy(str)
+    if six.PY3:
+        __bytes__ = _proxy(bytes)
+        __bool__ = _proxy(bool)
+    else:
+        __unicode__ = _proxy(six.text_type)
+        __nonzero__ = _proxy(bool)
+        __div__ = _proxy(operator.div)
+        __rdiv__ = _proxy(_reverse(operator.div))
+
+    __eq__ = _proxy(operator.eq)
+    __ne__ = _proxy(operator.ne)
+    __lt__ = _proxy(operator.lt)
+    __le__ = _proxy(operator.le)
+    __gt__ = _proxy(operator.gt)
+    __ge__ = _proxy(operator.ge)
+    __hash__ = _proxy(hash)
+    __len__ = _proxy(len)
+    __iter__ = _proxy(iter)
+    __contains__ = _proxy(operator.contains)
+    __getitem__ = _proxy(operator.getitem)
+    __int__ = _proxy(int)
+    __float__ = _proxy(float)
+    __neg__ = _proxy(operator.neg)
+    __add__ = _proxy(operator.add)
+    __radd__ = _proxy(_reverse(operator.add))
+    __sub__ = _proxy(operator.sub)
+    __rsub__ = _proxy(_reverse(operator.sub))
+    __mul__ = _proxy(operator.mul)
+    __rmul__ = _proxy(_reverse(operator.mul))
+    __floordiv__ = _proxy(operator.floordiv)
+    __rfloordiv__ = _proxy(_reverse(operator.floordiv))
+    __truediv__ = _proxy(operator.truediv)
+    __rtruediv__ = _proxy(_reverse(operator.truediv))
+    __mod__ = _proxy(operator.mod)
+    __rmod__ = _proxy(_reverse(operator.mod))
+
+
+def lazy_setting(setting):
+    """
+    Returns a proxy for the value of a setting, given by its
+    (module_name, class_name, attribute_name) key or its name (see
+    dbsettings.loading.get_setting_name). It's cheap to create at import time
+    and reads the setting only when first used, and again once settings have
+    changed::
+
+        MAX_WIDTH = lazy_setting('myapp.Image.maximum_width')
+
+        def resize(image):
+            if image.width > MAX_WIDTH:
+                ...
+    """
+    return LazySetting(setting)
@@ -2,6 +2,9 @@ from __future__ import unicode_literals
 from django.utils import six
 
 import datetime
+import json
+import logging
+import re
 from decimal import Decimal
 from hashlib import md5
 from os.path import join as pjoin
@@ -10,31 +13,39 @@ import os
 
 from django import forms
 from django.conf import settings
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.exceptions import ImproperlyConfigured
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.utils import formats
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 
-from dbsettings.loading import get_setting_storage, set_setting_value
+from dbsettings import loading
+from dbsettings.loading import get_setting_storage, get_settings_version, set_setting_value
+from dbsettings.utils import LazySetting, freeze
 
 __all__ = ['Value', 'BooleanValue', 'DecimalValue', 'EmailValue',
            'DurationValue', 'FloatValue', 'IntegerValue', 'PercentValue',
            'PositiveIntegerValue', 'StringValue', 'TextValue', 'PasswordValue',
-           'MultiSeparatorValue', 'ImageValue',
+           'MultiSeparatorValue', 'JSONValue', 'ImageValue',
            'DateTimeValue', 'DateValue', 'TimeValue']
 
+logger = logging.getLogger('dbsettings')
+
 
 class Value(object):
 
     creation_counter = 0
     unitialized_value = None
 
-    def __init__(self, description=None, help_text=None, choices=None, required=True, default=None, widget=None):
+    def __init__(self, description=None, help_text=None, choices=None, required=True, default=None, widget=None,
+                 cache_timeout=DEFAULT_TIMEOUT):
         self.description = description
         self.help_text = help_text
-        self.choices = choices or []
+        self.choices = choices
         self.required = required
         self.widget = widget
+        self.cache_timeout = cache_timeout
         if default is None:
             self.default = self.unitialized_value
         else:
@@ -42,6 +53,7 @@ class Value(object):
 
         self.creation_counter = Value.creation_counter
         Value.creation_counter += 1
+        self._invalid_values = set()
 
     def __lt__(self, other):
         # This is needed because bisect does not take a comparison function.
@@ -50,8 +62,56 @@ class Value(object):
     def copy(self):
         new_value = self.__class__()
         new_value.__dict__ = self.__dict__.copy()
+        new_value._invalid_values = set()
         return new_value
 
+    @property
+    def choices(self):
+        return self._get_choices()[0]
+
+    @choices.setter
+    def choices(self, choices):
+        # A list, or a callable returning one, which is then evaluated when
+        # first needed and again after settings were changed
+        self._choices = choices or []
+        self._choices_memo = None
+
+    def _get_choices(self):
+        "Returns the choices and the set of their values, as text"
+        if not callable(self._choices):
+            if self._choices_memo is None:
+                self._choices_memo = (None, self._choices, self._choice_values(self._choices))
+            return self._choices_memo[1:]
+        version = get_settings_version()
+        memo = self._choices_memo
+        # Without the cache there's no version to tell whether settings changed
+        if memo is None or version is None or memo[0] != version:
+            choices = list(self._choices())
+            memo = self._choices_memo = (version, choices, self._choice_values(choices))
+        return memo[1:]
+
+    @staticmethod
+    def _choice_values(choices):
+        values = set()
+        for value, label in choices:
+            if isinstance(label, (list, tuple)):
+                # Grouped choices
+                values.update(six.text_type(v) for v, _ in label)
+            else:
+                values.add(six.text_type(value))
+        return frozenset(values)
+
+    def invalidate_choices(self):
+        "Makes callable choices be evaluated again on next use"
+        self._choices_memo = None
+
+    def is_valid_choice(self, value):
+        "Returns whether the value is one of the choices, if there are any"
+        choices, values = self._get_choices()
+        if not choices or (not self.required and self.meaningless(value)):
+            return True
+        return six.text_type(self.get_db_prep_save(value)) in values
+
     @property
     def key(self):
         return self.module_name, self.class_name, self.attribute_name
@@ -66,23 +126,57 @@ class Value(object):
 
     @property
     def app(self):
-        return getattr(self, '_app', self.module_name.split('.')[-2])
+        if hasattr(self, '_app'):
+            return self._app
+        return self.module_name.split('.')[-2]
 
     def __get__(self, instance=None, cls=None):
         if instance is None:
             raise AttributeError("%r is only accessible from %s instances." %
                                  (self.attribute_name, cls.__name__))
+        if loading._profiling:
+            from dbsettings.profiling import profiled_get
+            return profiled_get(self)
+        if loading._preload is not None:
+            value = loading._get_preloaded_value(self.key)
+            if value is not loading._NOT_PRELOADED:
+                return value
         try:
             storage = get_setting_storage(*self.key)
-            return self.to_python(storage.value)
-        except:
+        except ImproperlyConfigured:
+            raise
+        except Exception:
+            # E.g. before the table was created by migrate
             return None
+        return self.decode(storage.value)
 
     def __set__(self, instance, value):
-        current_value = self.__get__(instance)
-        python_value = value if value is None else self.to_python(value)
-        if python_value != current_value:
-            set_setting_value(*(self.key + (value,)))
+        set_setting_value(*(self.key + (value,)))
+
+    def decode(self, value):
+        """
+        Returns to_python() of a stored value, or of the default if it can't be
+        decoded, e.g. after it was changed in the database by hand. Such values
+        are logged once and remembered, so reads don't fail on them again.
+        """
+        # Stored values are text, defaults may be anything (e.g. dicts)
+        stored = isinstance(value, six.string_types)
+        if not stored or value not in self._invalid_values:
+            try:
+                return self.to_python(value)
+            except Exception:
+                logger.warning('Invalid value %r stored for %s, using the default instead.',
+                               value, '.'.join(self.key), exc_info=True)
+                if stored:
+                    self._invalid_values.add(value)
+        try:
+            return self.to_python(self.default)
+        except Exception:
+            return None
+
+    def lazy(self):
+        "Returns a proxy for the value, see dbsettings.utils.lazy_setting"
+        return LazySetting(self)
 
     # Subclasses should override the following methods where applicable
 
@@ -95,6 +189,9 @@ class Value(object):
 
     def get_db_prep_save(self, value):
         "Returns a value suitable for storage into a CharField"
+        if value is None:
+            # Read back as None by non-text values, rather than failing
+            return ''
         return six.text_type(value)
 
     def to_editor(self, value):
@@ -246,7 +343,7 @@ class MultiSeparatorValue(TextValue):
     """
 
     def __init__(self, description=None, help_text=None, separator=';', required=True,
-                 default=None):
+                 default=None, **kwargs):
         self.separator = separator
         if default is not None:
             # convert from list to string
@@ -254,7 +351,8 @@ class MultiSeparatorValue(TextValue):
         super(MultiSeparatorValue, self).__init__(description=description,
                                                   help_text=help_text,
                                                   required=required,
-                                                  default=default)
+                                                  default=default,
+                                                  **kwargs)
 
     class field(forms.CharField):
 
@@ -270,6 +368,101 @@ class MultiSeparatorValue(TextValue):
             value = []
         return value
 
+    def matcher(self, ignore_case=False):
+        """
+        Returns a ListMatcher for the current value, to test whether strings
+        are in the list, where entries may contain * and ? wildcards.
+
+        Matchers are cached until the value changes.
+        """
+        raw = get_setting_storage(*self.key).value
+        memo = getattr(self, '_matchers', None)
+        if memo is None or memo[0] != raw:
+            memo = self._matchers = (raw, {})
+        try:
+            return memo[1][ignore_case]
+        except KeyError:
+            matcher = memo[1][ignore_case] = ListMatcher(self.to_python(raw), ignore_case)
+            return matcher
+
+
+class ListMatcher(object):
+    """
+    Tests strings against a list of entries: exact ones are looked up in a
+    frozenset, and those with * or ? wildcards are combined into one regex.
+    """
+
+    def __init__(self, entries, ignore_case=False):
+        self.ignore_case = ignore_case
+        if ignore_case:
+            entries = [entry.lower() for entry in entries]
+        self.exact = frozenset(e for e in entries if '*' not in e and '?' not in e)
+        patterns = [self._translate(e) for e in entries if e not in self.exact]
+        if patterns:
+            self.pattern = re.compile('(?:%s)\\Z' % '|'.join(patterns),
+                                      re.DOTALL | (re.IGNORECASE if ignore_case else 0))
+        else:
+            self.pattern = None
+
+    @staticmethod
+    def _translate(entry):
+        return ''.join('.*' if c == '*' else '.' if c == '?' else re.escape(c) for c in entry)
+
+    def __contains__(self, value):
+        if self.ignore_case:
+            value = value.lower()
+        if value in self.exact:
+            return True
+        return self.pattern is not None and self.pattern.match(value) is not None
+
+    match = __contains__
+
+
+class JSONValue(Value):
+    """Stores any JSON-serializable structure, e.g. a feature flag map.
+        The stored text is parsed only when it changes, and the result
+        is shared between readers, so it's returned as an immutable
+        structure: dicts become FrozenDicts and lists become tuples.
+    """
+
+    class field(forms.CharField):
+        widget = forms.Textarea
+
+        def clean(self, value):
+            value = forms.CharField.clean(self, value)
+            if value in self.empty_values:
+                return None
+            try:
+                return freeze(json.loads(value))
+            except ValueError:
+                raise forms.ValidationError(_('Enter a valid JSON document.'))
+
+    def __init__(self, *args, **kwargs):
+        super(JSONValue, self).__init__(*args, **kwargs)
+        self._parsed = (None, None)
+
+    def to_python(self, value):
+        if not isinstance(value, six.string_types):
+            return freeze(value)
+        if self.meaningless(value):
+            return None
+        raw, parsed = self._parsed
+        if raw != value:
+            parsed = freeze(json.loads(value))
+            self._parsed = (value, parsed)
+        return parsed
+
+    def get_db_prep_save(self, value):
+        if isinstance(value, six.string_types):
+            value = json.loads(value)
+        return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+    def to_editor(self, value):
+        value = self.to_python(value)
+        if value is None:
+            return ''
+        return json.dumps(value, sort_keys=True, indent=2)
+
 
 class ImageValue(Value):
     def __init__(self, *args, **kwargs):
@@ -347,12 +540,14 @@ class DateTimeValue(Value):
         return formats.get_format(self.formats_source)
 
     def _parse_format(self, value):
+        if not value:
+            return None
         for format in self._formats:
             try:
                 return datetime.datetime.strptime(value, format)
             except (ValueError, TypeError):
                 continue
-        return None
+        raise ValueError('%r does not match any of the input formats.' % (value,))
 
     def get_db_prep_save(self, value):
         if isinstance(value, six.string_types):
@@ -1,14 +1,48 @@
 from __future__ import unicode_literals
+import hashlib
+import hmac
+import json
+import time
+
 from django.utils import six
 
-from django.http import HttpResponseRedirect
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import (HttpResponseBadRequest, HttpResponseForbidden,
+                         HttpResponseRedirect, JsonResponse)
 from django.shortcuts import render
 from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.http import condition, require_GET
 from django.utils.text import capfirst
 from django.utils.translation import ugettext_lazy as _
 from django.contrib import messages
 
 from dbsettings import loading, forms
+from dbsettings.backends import DatabaseBackend
+
+# Longest wait of a long-polling request for changes, in seconds
+CHANGES_MAX_WAIT = 30
+# How often a long-polling request checks for changes, in seconds
+CHANGES_POLL_INTERVAL = 1
+
+
+def _matches(setting, query):
+    "Returns whether the setting matches a search query"
+    text = ' '.join(six.text_type(s) for s in (setting.description, setting.attribute_name,
+                                               setting.class_name, setting.module_name))
+    return all(word in text.lower() for word in query.lower().split())
+
+
+def _get_page(request, settings):
+    "Returns the page of the settings requested by the user"
+    from dbsettings.settings import EDITOR_PAGE_SIZE
+    paginator = Paginator(settings, EDITOR_PAGE_SIZE or len(settings) or 1)
+    try:
+        return paginator.page(request.GET.get('page', 1))
+    except PageNotAnInteger:
+        return paginator.page(1)
+    except EmptyPage:
+        return paginator.page(paginator.num_pages)
 
 
 @staff_member_required
@@ -21,27 +55,44 @@ def app_settings(request, app_label, template='dbsettings/app_settings.html'):
         settings = loading.get_app_settings(app_label)
         title = _('%(app)s settings') % {'app': capfirst(app_label)}
 
-    # Create an editor customized for the current user
-    editor = forms.customized_editor(request.user, settings)
+    # Only show the settings the user may change, narrowed down by the search
+    settings = [s for s in settings if forms.can_edit(request.user, s)]
+    group = request.GET.get('group', '')
+    if group:
+        settings = [s for s in settings if s.class_name == group]
+    query = request.GET.get('q', '').strip()
+    if query:
+        settings = [s for s in settings if _matches(s, query)]
+    page = _get_page(request, settings)
+
+    # Create an editor customized for the current user, with the current page only
+    editor = forms.customized_editor(request.user, page.object_list)
 
     if request.method == 'POST':
         # Populate the form with user-submitted data
         form = editor(request.POST.copy(), request.FILES)
+        try:
+            # Versions of the settings which the user has seen
+            versions = json.loads(request.POST.get('dbsettings_versions', '{}'))
+        except ValueError:
+            versions = {}
         if form.is_valid():
             form.full_clean()
 
-            for name, value in form.cleaned_data.items():
+            for name, value in list(form.cleaned_data.items()):
                 key = forms.RE_FIELD_NAME.match(name).groups()
                 setting = loading.get_setting(*key)
-                try:
-                    storage = loading.get_setting_storage(*key)
-                    current_value = setting.to_python(storage.value)
-                except:
-                    current_value = None
 
-                if current_value != setting.to_python(value):
+                # Compare with the values the editor was built with
+                if form.values[name] != setting.to_python(value):
                     args = key + (value,)
-                    loading.set_setting_value(*args)
+                    try:
+                        if not loading.set_setting_value(*args, expected=versions.get(name)):
+                            continue
+                    except loading.SettingConflict:
+                        form.add_error(name, _('This setting was changed by someone else '
+                                               'in the meantime. Save again to overwrite it.'))
+                        continue
 
                     # Give user feedback as to which settings were changed
                     if setting.class_name:
@@ -53,14 +104,21 @@ def app_settings(request, app_label, template='dbsettings/app_settings.html'):
                                    'location': location})
                     messages.add_message(request, messages.INFO, update_msg)
 
-            return HttpResponseRedirect(request.path)
+            if not form.errors:
+                return HttpResponseRedirect(request.get_full_path())
     else:
         # Leave the form populated with current setting values
         form = editor()
 
+    querystring = request.GET.copy()
+    querystring.pop('page', None)
     return render(request, template, {
         'title': title,
         'form': form,
+        'page': page,
+        'query': query,
+        'group': group,
+        'querystring': querystring.urlencode(),
     })
 
 
@@ -68,3 +126,105 @@ def app_settings(request, app_label, template='dbsettings/app_settings.html'):
 def site_settings(request):
     return app_settings(request, app_label=None, template='dbsettings/site_settings.html')
 # staff_member_required is implied, since it calls app_settings
+
+
+class SettingsJSONEncoder(DjangoJSONEncoder):
+    "Encodes any other values, like durations, as text"
+
+    def default(self, o):
+        try:
+            return super(SettingsJSONEncoder, self).default(o)
+        except TypeError:
+            return six.text_type(o)
+
+
+def _json_settings(request, app_label):
+    "Settings requested through the JSON API"
+    if app_label is None:
+        settings = loading.get_all_settings()
+    else:
+        settings = loading.get_app_settings(app_label)
+    fields = [f for f in request.GET.get('fields', '').split(',') if f]
+    if fields:
+        # Either full names or prefixes of names, like app or app.Class
+        names = dict((s, loading.get_setting_name(s)) for s in settings)
+        settings = [s for s in settings if any(
+            names[s] == f or names[s].startswith(f + '.') for f in fields)]
+    return settings
+
+
+def _json_etag(request, app_label=None):
+    backend = loading.get_backend()
+    version = backend.get_version()
+    if version is None and isinstance(backend, DatabaseBackend):
+        # Without the cache, every change still takes a sequence number
+        version = loading._get_change_sequence()
+    if version is None:
+        return None
+    parts = [six.text_type(version), six.text_type(loading._get_site_id()),
+             app_label or '', request.GET.get('fields', '')]
+    return hashlib.md5('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _can_read_json(request):
+    from dbsettings.settings import API_TOKEN
+    auth = request.META.get('HTTP_AUTHORIZATION', '')
+    if API_TOKEN and auth.startswith('Token '):
+        return hmac.compare_digest(auth[6:].strip().encode('utf-8'),
+                                   API_TOKEN.encode('utf-8'))
+    return request.user.is_active and request.user.is_staff
+
+
+@condition(etag_func=_json_etag)
+def _settings_json(request, app_label=None):
+    settings = _json_settings(request, app_label)
+    storages = loading.get_setting_storages(s.key for s in settings)
+    values = {}
+    for setting in settings:
+        name = loading.get_setting_name(setting)
+        values[name] = setting.decode(storages[setting.key].value)
+    return JsonResponse({'version': loading.get_settings_version(), 'settings': values},
+                        encoder=SettingsJSONEncoder)
+
+
+@require_GET
+def settings_json(request, app_label=None):
+    """
+    Read-only JSON view of setting values, for consumers outside of Django.
+
+    Responses carry an ETag based on the backend's settings version and the
+    site, so polling clients get a 304 Not Modified until something is changed.
+    """
+    if not _can_read_json(request):
+        return HttpResponseForbidden()
+    return _settings_json(request, app_label)
+
+
+@require_GET
+def settings_changes(request):
+    """
+    JSON feed of settings changed after the sequence number in ``since``.
+    Without it, all settings are returned along with the current sequence
+    number, to follow changes from.
+
+    With ``wait``, the request is held for up to that many seconds until
+    something changes.
+    """
+    if not _can_read_json(request):
+        return HttpResponseForbidden()
+    try:
+        since = request.GET.get('since')
+        since = int(since) if since is not None else None
+        wait = min(float(request.GET.get('wait', 0)), CHANGES_MAX_WAIT)
+    except ValueError:
+        return HttpResponseBadRequest('since and wait must be numbers.')
+    deadline = time.time() + wait
+    while True:
+        sequence, changes = loading.get_changed_settings(since)
+        if sequence != since or time.time() >= deadline:
+            break
+        time.sleep(CHANGES_POLL_INTERVAL)
+    values = dict((loading.get_setting_name(loading.get_setting(*key)), value)
+                  for key, value in changes.items())
+    return JsonResponse({'sequence': sequence, 'settings': values},
+                        encoder=SettingsJSONEncoder)
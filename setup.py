@@ -22,7 +22,10 @@ setup(
     url='http://github.com/zlorf/django-dbsettings',
     packages=[
         'dbsettings',
+        'dbsettings.management',
+        'dbsettings.management.commands',
         'dbsettings.migrations',
+        'dbsettings.templatetags',
     ],
     include_package_data=True,
     license='BSD',
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+"""
+Load and consistency harness for dbsettings.
+
+Runs a mix of single reads, bulk reads and writes of settings from several
+threads in several processes against a temporary SQLite database and either
+the locmem or the file-based cache, then reports throughput and latencies per
+operation and checks that:
+
+- no increments or compare-and-set writes were lost, including increments of
+  a setting which all threads store for the first time at once,
+- no process read a value older than one committed more than the cache
+  timeout (plus the local cache timeout) before the read started,
+- no setting is stored in more than one row, including settings which all
+  threads store for the first time at once.
+
+Processes are forked, so this runs on Linux and other platforms where
+multiprocessing forks by default. Exits with status 1 if any check fails, e.g.:
+
+    $ python stresstest.py --processes 4 --threads 8 --duration 10 --cache file
+"""
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+import django
+from django.conf import settings
+
+SETTINGS_COUNT = 20
+# Settings which aren't stored yet, written by every thread when it starts
+FRESH_COUNT = 5
+
+# Cache entries may be this much older than the timeout, e.g. when they were
+# written right after being read from the database.
+STALENESS_SLACK = 0.5
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Load and consistency harness for dbsettings.')
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4, help='Threads per process.')
+    parser.add_argument('--duration', type=float, default=5, help='Seconds to run.')
+    parser.add_argument('--cache', choices=['locmem', 'file'], default='locmem')
+    parser.add_argument('--cache-timeout', type=float, default=1,
+                        help='DBSETTINGS_CACHE_TIMEOUT, the bound for stale reads.')
+    parser.add_argument('--local-cache-timeout', type=float, default=0,
+                        help='DBSETTINGS_LOCAL_CACHE_TIMEOUT.')
+    parser.add_argument('--write-ratio', type=float, default=0.05)
+    parser.add_argument('--bulk-ratio', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=None)
+    return parser.parse_args()
+
+
+def configure(args, directory):
+    if args.cache == 'file':
+        cache = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                 'LOCATION': '%s/cache' % directory}
+    else:
+        cache = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    settings.configure(
+        INSTALLED_APPS=(
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'django.contrib.sites',
+            'dbsettings',
+        ),
+        SITE_ID=1,
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': '%s/db.sqlite3' % directory,
+                # Writers queue for the database lock instead of failing
+                'OPTIONS': {'timeout': 30},
+            },
+        },
+        CACHES={'default': cache},
+        DBSETTINGS_CACHE_TIMEOUT=args.cache_timeout,
+        DBSETTINGS_LOCAL_CACHE_TIMEOUT=args.local_cache_timeout,
+    )
+    django.setup()
+
+
+def make_settings():
+    import dbsettings
+
+    attrs = dict(('value_%d' % i, dbsettings.StringValue()) for i in range(SETTINGS_COUNT))
+    attrs.update(('fresh_%d' % i, dbsettings.StringValue()) for i in range(FRESH_COUNT))
+    attrs['counter'] = dbsettings.IntegerValue()
+    attrs['fresh_counter'] = dbsettings.IntegerValue()
+    attrs['token'] = dbsettings.StringValue()
+    StressSettings = type('StressSettings', (dbsettings.Group,), attrs)
+    return StressSettings(app_label='stress')
+
+
+class Shared(object):
+    "State shared by all processes, for the consistency checks"
+
+    def __init__(self):
+        self.lock = multiprocessing.Lock()
+        # Highest counter value known to be committed, and when it was
+        self.committed = multiprocessing.Value('l', 0, lock=False)
+        self.committed_at = multiprocessing.Value('d', 0, lock=False)
+
+    def commit(self, value, at):
+        with self.lock:
+            if value > self.committed.value:
+                self.committed.value = value
+                self.committed_at.value = at
+
+    def snapshot(self):
+        with self.lock:
+            return self.committed.value, self.committed_at.value
+
+
+class Worker(object):
+    def __init__(self, args, group, shared, bound, seed):
+        self.args = args
+        self.group = group
+        self.settings = dict(group._settings)
+        self.shared = shared
+        self.bound = bound
+        self.random = random.Random(seed)
+        self.latencies = {}
+        self.errors = []
+        self.stale_reads = []
+        self.increments = 0
+        self.first_increments = 0
+        self.cas_writes = 0
+
+    def timed(self, name, func, *args):
+        start = time.time()
+        try:
+            return func(*args)
+        except Exception:
+            self.errors.append('%s: %s' % (name, traceback.format_exc().splitlines()[-1]))
+        finally:
+            self.latencies.setdefault(name, []).append(time.time() - start)
+
+    def read(self):
+        # Reading the counter is also checked for staleness
+        committed, committed_at = self.shared.snapshot()
+        start = time.time()
+        value = self.timed('read', getattr, self.group, 'counter')
+        if value is not None and value < committed and start - committed_at > self.bound:
+            self.stale_reads.append((value, committed, start - committed_at))
+
+    def bulk_read(self):
+        from dbsettings.loading import get_setting_storages
+        keys = [value.key for value in self.settings.values()]
+        self.timed('bulk_read', get_setting_storages, keys)
+
+    def increment(self):
+        value = self.timed('increment', self.group.incr, 'counter')
+        if value is not None:
+            self.increments += 1
+            self.shared.commit(value, time.time())
+
+    def compare_and_set(self):
+        self.timed('compare_and_set', self._compare_and_set, self.settings['token'].key)
+
+    def _compare_and_set(self, key):
+        from dbsettings import loading
+        version = loading.get_setting_storage(*key).version
+        try:
+            loading.set_setting_value(*(key + ('%x' % self.random.getrandbits(64),)),
+                                      expected=version)
+        except loading.SettingConflict:
+            return
+        self.cas_writes += 1
+
+    def write(self):
+        name = 'value_%d' % self.random.randrange(SETTINGS_COUNT)
+        self.timed('write', setattr, self.group, name, '%x' % self.random.getrandbits(64))
+
+    def first_write(self):
+        for i in range(FRESH_COUNT):
+            self.timed('first_write', setattr, self.group, 'fresh_%d' % i,
+                       '%x' % self.random.getrandbits(64))
+        if self.timed('first_increment', self.group.incr, 'fresh_counter') is not None:
+            self.first_increments += 1
+
+    def run(self, deadline):
+        from django.db import connections
+        args = self.args
+        writes = [self.increment, self.compare_and_set, self.write]
+        try:
+            self.first_write()
+            while time.time() < deadline:
+                r = self.random.random()
+                if r < args.write_ratio:
+                    self.random.choice(writes)()
+                elif r < args.write_ratio + args.bulk_ratio:
+                    self.bulk_read()
+                else:
+                    self.read()
+        finally:
+            connections.close_all()
+
+
+def run_process(args, group, shared, seed, start_at, results):
+    from django.db import connections
+    bound = args.cache_timeout + args.local_cache_timeout + STALENESS_SLACK
+    workers = [Worker(args, group, shared, bound, seed * 1000 + i) for i in range(args.threads)]
+    deadline = start_at + args.duration
+    time.sleep(max(0, start_at - time.time()))
+    threads = [threading.Thread(target=w.run, args=(deadline,)) for w in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    connections.close_all()
+    result = {'latencies': {}, 'errors': [], 'stale_reads': [], 'increments': 0,
+              'first_increments': 0, 'cas_writes': 0}
+    for worker in workers:
+        for name, latencies in worker.latencies.items():
+            result['latencies'].setdefault(name, []).extend(latencies)
+        result['errors'].extend(worker.errors)
+        result['stale_reads'].extend(worker.stale_reads)
+        result['increments'] += worker.increments
+        result['first_increments'] += worker.first_increments
+        result['cas_writes'] += worker.cas_writes
+    results.put(result)
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def report(args, results):
+    latencies = {}
+    for result in results:
+        for name, values in result['latencies'].items():
+            latencies.setdefault(name, []).extend(values)
+    print('%-16s %9s %9s %9s %9s %9s %9s' % ('operation', 'count', 'ops/s', 'p50 ms',
+                                             'p95 ms', 'p99 ms', 'max ms'))
+    for name, values in sorted(latencies.items()):
+        values.sort()
+        print('%-16s %9d %9.0f %9.2f %9.2f %9.2f %9.2f' % (
+            name, len(values), len(values) / args.duration,
+            percentile(values, .5) * 1000, percentile(values, .95) * 1000,
+            percentile(values, .99) * 1000, values[-1] * 1000))
+
+
+def check(group, results, initial_version):
+    from django.db.models import Count
+    from dbsettings import loading
+    from dbsettings.models import Setting
+
+    failures = []
+    increments = sum(result['increments'] for result in results)
+    counter = loading.get_setting_storage(*dict(group._settings)['counter'].key)
+    if int(counter.value or 0) != increments:
+        failures.append('Lost increments: %s stored after %d increments.' %
+                        (counter.value, increments))
+
+    first_increments = sum(result['first_increments'] for result in results)
+    counter = loading.get_setting_storage(*dict(group._settings)['fresh_counter'].key)
+    if int(counter.value or 0) != first_increments:
+        failures.append('Lost first increments: %s stored after %d increments.' %
+                        (counter.value, first_increments))
+
+    cas_writes = sum(result['cas_writes'] for result in results)
+    token = loading.get_setting_storage(*dict(group._settings)['token'].key)
+    if token.version != initial_version + cas_writes:
+        failures.append('Lost compare-and-set writes: version %d after %d writes.' %
+                        (token.version, cas_writes))
+
+    stale_reads = [read for result in results for read in result['stale_reads']]
+    if stale_reads:
+        value, committed, age = max(stale_reads, key=lambda read: read[2])
+        failures.append('%d stale reads, e.g. %d read %.2fs after %d was committed.' %
+                        (len(stale_reads), value, age, committed))
+
+    duplicates = Setting.all_sites.values('module_name', 'class_name', 'attribute_name',
+                                          'site').annotate(rows=Count('pk')).filter(rows__gt=1)
+    for row in duplicates:
+        failures.append('Duplicate rows for %(module_name)s.%(class_name)s.%(attribute_name)s '
+                        '(site %(site)s): %(rows)d' % row)
+
+    errors = [error for result in results for error in result['errors']]
+    if errors:
+        failures.append('%d operations failed, e.g. %s' % (len(errors), errors[0]))
+    return failures
+
+
+def main():
+    args = parse_args()
+    directory = tempfile.mkdtemp(prefix='dbsettings-stress-')
+    try:
+        configure(args, directory)
+        from django.core.cache import cache
+        from django.core.management import call_command
+        from django.db import connections
+
+        call_command('migrate', verbosity=0)
+        group = make_settings()
+        from dbsettings import loading
+        token = loading.get_setting_storage(*dict(group._settings)['token'].key)
+        # Connections and the cache must not be shared with forked processes
+        connections.close_all()
+        cache.clear()
+
+        seed = args.seed if args.seed is not None else random.randrange(1 << 30)
+        print('Running %d processes with %d threads for %gs, %s cache, seed %d' % (
+            args.processes, args.threads, args.duration, args.cache, seed))
+        shared = Shared()
+        queue = multiprocessing.Queue()
+        start_at = time.time() + 0.5
+        processes = [multiprocessing.Process(target=run_process,
+                                             args=(args, group, shared, seed + i, start_at, queue))
+                     for i in range(args.processes)]
+        for process in processes:
+            process.start()
+        results = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        report(args, results)
+        cache.clear()
+        failures = check(group, results, token.version)
+        for failure in failures:
+            print('FAILED: %s' % failure)
+        if not failures:
+            print('OK')
+        return 1 if failures else 0
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())